@@ -0,0 +1,19 @@
+""" Общие расчёты для команд-бенчмарков. """
+
+
+def percentile(values, share):
+    """ Значение, ниже которого доля `share` замеров (0 для пустых). """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def latency_summary(seconds):
+    """ p50/p95/p99 и среднее в миллисекундах. """
+    return {
+        'p50_ms': percentile(seconds, 0.5) * 1000,
+        'p95_ms': percentile(seconds, 0.95) * 1000,
+        'p99_ms': percentile(seconds, 0.99) * 1000,
+        'mean_ms': sum(seconds) / len(seconds) * 1000 if seconds else 0,
+    }
@@ -0,0 +1,200 @@
+""" Поколения (версии) закэшированных данных.
+
+Каждая область данных (`posts`, `group:<id>`, `author:<id>`, ...) имеет
+счётчик-поколение в кэше. Запись в область увеличивает счётчик, а ключи
+фрагментов включают текущие поколения, поэтому устаревшие фрагменты
+просто перестают читаться и вытесняются по TTL.
+
+Значения фрагментов и страниц хранятся в обёртке `Entry`: срок
+свежести, время пересчёта и поколения областей. Просроченная или
+сброшенная запись ещё `STALE_TTL` секунд отдаётся, пока один процесс
+под блокировкой в кэше (`lock`) считает новую (stale-while-revalidate);
+при отсутствии записи остальные ждут его результата, а не считают
+сами. Незадолго до истечения запись пересчитывается заранее с
+растущей вероятностью (XFetch).
+"""
+import hashlib
+import math
+import random
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import quote_etag
+
+GENERATION_KEY = 'generation:{}'
+LOCK_KEY = 'lock:{}'
+# Сколько просроченная запись ещё может отдаваться, с.
+STALE_TTL = 60
+# Блокировка пересчёта истекает сама, если процесс упал.
+LOCK_TIMEOUT = 30
+# Сколько ждать чужого пересчёта отсутствующей записи, с.
+LOCK_WAIT = 3
+POLL_INTERVAL = 0.05
+# Поколение данных реплик: сдвигается после их синхронизации, чтобы
+# фрагмент, собранный по отстающей реплике, не пережил её обновление.
+REPLICA_SCOPE = 'replicas'
+
+
+def _seed():
+    # После вытеснения счётчик начинается с метки времени в мкс и не
+    # повторяет прежние значения.
+    return int(time.time() * 1000000)
+
+
+def read_scopes(scopes):
+    """ Области данных страницы, включая реплики, если чтение с них. """
+    if settings.DATABASE_REPLICAS:
+        return (*scopes, REPLICA_SCOPE)
+    return tuple(scopes)
+
+
+def generations(*scopes):
+    """ Текущие поколения областей в порядке аргументов. """
+    keys = [GENERATION_KEY.format(scope) for scope in scopes]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, _seed(), timeout=None)
+            found[key] = cache.get(key, _seed())
+    return [found[key] for key in keys]
+
+
+def bump(*scopes):
+    """ Сдвигает поколения областей после записи. """
+    for scope in set(scopes):
+        key = GENERATION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _seed(), timeout=None)
+
+
+def invalidate(*scopes):
+    """ Сдвигает поколения сейчас и ещё раз после фиксации транзакции.
+
+    Повторный сдвиг не даёт пережить коммит фрагменту, собранному
+    параллельным запросом по ещё старым данным.
+    """
+    bump(*scopes)
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def fragment_key(*parts, scopes=()):
+    """ Строка для vary_on тега `{% cache %}`: части ключа и поколения. """
+    versions = generations(*read_scopes(scopes))
+    return ':'.join(str(part) for part in (*parts, *versions))
+
+
+def page_etag(request, versions):
+    """ ETag страницы по поколениям областей, которые она выводит.
+
+    Разметка зависит ещё от пользователя и CSRF-токена в формах, поэтому
+    они тоже входят в тег. Токен берётся тот, что уйдёт в куке ответа:
+    его выставляет `get_token` при рендеринге формы.
+    """
+    parts = (
+        request.get_full_path(),
+        request.user.pk,
+        request.META.get('CSRF_COOKIE')
+        or request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+        *versions,
+    )
+    digest = hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+class Entry(namedtuple('Entry', 'value expires delta scopes versions')):
+    """ Значение в кэше со сроком свежести и поколениями областей. """
+
+    def stale(self, now=None):
+        now = time.time() if now is None else now
+        if now >= self.expires:
+            return True
+        return bool(self.scopes) and generations(*self.scopes) != self.versions
+
+    def due(self, now=None):
+        """ Пора ли пересчитать заранее.
+
+        Вероятность растёт к истечению и с длительностью пересчёта
+        `delta`: сдвиг `-delta * beta * ln(rand)` (XFetch). При
+        `CACHE_EARLY_BETA = 0` пересчёт только после истечения.
+        """
+        beta = settings.CACHE_EARLY_BETA
+        if not beta or not self.delta:
+            return False
+        now = time.time() if now is None else now
+        early = -self.delta * beta * math.log(1 - random.random())
+        return now + early >= self.expires
+
+
+def fetch(key):
+    """ Запись `Entry`, свежая или просроченная, или None. """
+    entry = cache.get(key)
+    return entry if isinstance(entry, Entry) else None
+
+
+def store(key, value, timeout, delta=0, scopes=(), versions=()):
+    """ Кладёт значение; физически оно живёт ещё STALE_TTL. """
+    if timeout is None:
+        expires, ttl = math.inf, None
+    else:
+        expires, ttl = time.time() + timeout, timeout + STALE_TTL
+    cache.set(
+        key, Entry(value, expires, delta, tuple(scopes), list(versions)), ttl
+    )
+
+
+@contextmanager
+def lock(key):
+    """ Блокировка пересчёта ключа в кэше; отдаёт, получена ли она. """
+    lock_key = LOCK_KEY.format(key)
+    acquired = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cache.delete(lock_key)
+
+
+def wait(key):
+    """ Ждёт запись, которую считает другой процесс, не дольше LOCK_WAIT.
+
+    Блокировка снята, а записи нет — другой процесс ничего не сохранил,
+    и ждать дальше нечего.
+    """
+    lock_key = LOCK_KEY.format(key)
+    deadline = time.monotonic() + LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        entry = fetch(key)
+        if entry is not None:
+            return entry
+        if cache.get(lock_key) is None:
+            break
+    return None
+
+
+def get_or_set(key, compute, timeout):
+    """ Значение из кэша или `compute()` без лавины пересчётов.
+
+    Свежая запись отдаётся сразу. Иначе пересчитывает только процесс,
+    взявший блокировку; остальные отдают просроченную запись или ждут
+    новую.
+    """
+    entry = fetch(key)
+    if entry is not None and not entry.stale() and not entry.due():
+        return entry.value
+    with lock(key) as acquired:
+        if acquired:
+            begin = time.monotonic()
+            value = compute()
+            store(key, value, timeout, time.monotonic() - begin)
+            return value
+    if entry is not None:
+        return entry.value
+    entry = wait(key)
+    return entry.value if entry is not None else compute()
@@ -0,0 +1,482 @@
+""" Кэш, общий для всех процессов узла, в файле SQLite.
+
+`LocMemCache` держит отдельную копию в каждом WSGI-воркере; этот бэкенд
+хранит записи в одном файле (WAL, поэтому чтения не ждут записи),
+ограничивает их число `MAX_ENTRIES` с вытеснением давно не читанных
+(LRU), атомарно выполняет `incr` и ведёт статистику попаданий.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backends.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+`TieredCache` ставит перед таким общим кэшем небольшой LRU в памяти
+процесса: горячие ключи читаются без обращения к файлу. Запись идёт в
+оба уровня, а чужие записи процесс видит не позже чем через
+`LOCAL_TIMEOUT` секунд. Поэтому мимо локального уровня идут ключи,
+которые должны быть общими сразу: поколения и блокировки
+(`core.cache`). Значения в `core.cache.Entry` сверяют поколения при
+чтении, и короткая задержка им не страшна.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.cache_backends.TieredCache',
+            'LOCATION': 'shared',
+            'OPTIONS': {'MAX_ENTRIES': 500, 'LOCAL_TIMEOUT': 5},
+        },
+        'shared': {'BACKEND': 'core.cache_backends.SQLiteCache', ...},
+    }
+"""
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from . import instrumentation
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache ('
+    ' key TEXT PRIMARY KEY, value BLOB, expires REAL, accessed REAL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)',
+)
+STATS = ('hits', 'misses', 'evictions')
+# Время доступа обновляется не чаще раза в секунду на ключ, чтобы горячие
+# ключи не превращали каждое чтение в запись.
+ACCESS_RESOLUTION = 1.0
+STATS_FLUSH_EVERY = 100
+LOCAL_TIMEOUT = 5
+BYPASS = ('generation:', 'lock:')
+# Неизменяемые значения локальный уровень хранит как есть, остальные —
+# в pickle, чтобы запросы не делили один изменяемый объект.
+IMMUTABLE = (str, bytes, int, float, bool, type(None))
+MISSING = object()
+
+
+class SQLiteCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pending = dict.fromkeys(STATS, 0)
+        self._ops = 0
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(
+                self._path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _write(self, *statements):
+        """ Выполняет запросы одной транзакцией с блокировкой записи.
+
+        Возвращает для каждого запроса число изменённых строк и первую
+        строку результата.
+        """
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            results = []
+            for statement in statements:
+                cursor = db.execute(*statement)
+                results.append((cursor.rowcount, cursor.fetchone()))
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return results
+
+    @staticmethod
+    def _dump(value):
+        if type(value) is int and -2 ** 63 <= value < 2 ** 63:
+            return value
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def _load(value):
+        if isinstance(value, int):
+            return value
+        return pickle.loads(value)
+
+    def _count(self, stat, amount=1, flush=True):
+        with self._lock:
+            self._pending[stat] += amount
+            self._ops += 1
+            flush = flush and self._ops >= STATS_FLUSH_EVERY
+        if flush:
+            self._flush_stats()
+
+    def _flush_stats(self):
+        with self._lock:
+            pending, self._pending = self._pending, dict.fromkeys(STATS, 0)
+            self._ops = 0
+        statements = []
+        for name, amount in pending.items():
+            if amount:
+                statements += [
+                    ('INSERT OR IGNORE INTO stats VALUES (?, 0)', (name,)),
+                    ('UPDATE stats SET value = value + ? WHERE name = ?',
+                     (amount, name)),
+                ]
+        if statements:
+            self._write(*statements)
+
+    def _fetch(self, keys):
+        begin = time.perf_counter()
+        now = time.time()
+        marks = ','.join('?' * len(keys))
+        rows = self._db.execute(
+            f'SELECT key, value, expires, accessed FROM cache '
+            f'WHERE key IN ({marks})', keys
+        ).fetchall()
+        found, touched = {}, []
+        for key, value, expires, accessed in rows:
+            if expires is not None and expires <= now:
+                continue
+            found[key] = self._load(value)
+            if now - accessed > ACCESS_RESOLUTION:
+                touched.append(key)
+        if touched:
+            marks = ','.join('?' * len(touched))
+            self._write((
+                f'UPDATE cache SET accessed = ? WHERE key IN ({marks})',
+                [now, *touched]
+            ))
+        self._count('hits', len(found))
+        self._count('misses', len(keys) - len(found))
+        instrumentation.record_cache(
+            len(found), len(keys) - len(found), time.perf_counter() - begin
+        )
+        return found
+
+    def _cull(self):
+        """ Вытесняет просроченные и давно не читанные записи. """
+        now = time.time()
+        db = self._db
+        total = db.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if total <= self._max_entries:
+            return
+        expired = db.execute(
+            'DELETE FROM cache WHERE expires <= ?', (now,)
+        ).rowcount
+        excess = total - expired - self._max_entries
+        if excess > 0:
+            excess += self._max_entries // self._cull_frequency
+            db.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY accessed LIMIT ?)', (excess,)
+            )
+            self._count('evictions', excess, flush=False)
+
+    def _store(self, items, timeout, replace=True):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        verb = 'INSERT OR REPLACE' if replace else 'INSERT OR IGNORE'
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            stored = 0
+            for key, value in items:
+                if not replace:
+                    db.execute(
+                        'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                        (key, now)
+                    )
+                stored += db.execute(
+                    f'{verb} INTO cache VALUES (?, ?, ?, ?)',
+                    (key, self._dump(value), expires, now)
+                ).rowcount
+            self._cull()
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        return stored
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        return bool(self._store([(key, value)], timeout, replace=False))
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        return self._fetch([key]).get(key, default)
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        found = self._fetch(list(keys))
+        return {keys[key]: value for key, value in found.items()}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store([(self._key(key, version), value)], timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(
+            [(self._key(key, version), value) for key, value in data.items()],
+            timeout
+        )
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        ((updated, _),) = self._write((
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time())
+        ))
+        return bool(updated)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        (updated, _), (_, row) = self._write(
+            ('UPDATE cache SET value = value + ?, accessed = ? '
+             'WHERE key = ? AND typeof(value) = \'integer\' '
+             'AND (expires IS NULL OR expires > ?)', (delta, now, key, now)),
+            ('SELECT value FROM cache WHERE key = ?', (key,)),
+        )
+        if not updated:
+            raise ValueError(f"Key '{key}' not found")
+        return row[0]
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)', (key, time.time())
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        self._write((
+            'DELETE FROM cache WHERE key = ?', (self._key(key, version),)
+        ))
+
+    def delete_many(self, keys, version=None):
+        keys = [self._key(key, version) for key in keys]
+        if keys:
+            marks = ','.join('?' * len(keys))
+            self._write((f'DELETE FROM cache WHERE key IN ({marks})', keys))
+
+    def clear(self):
+        self._write(('DELETE FROM cache',))
+
+    def stats(self):
+        """ Попадания, промахи и вытеснения всех процессов узла. """
+        self._flush_stats()
+        totals = dict.fromkeys(STATS, 0)
+        totals.update(self._db.execute('SELECT name, value FROM stats'))
+        totals['entries'] = self._db.execute(
+            'SELECT COUNT(*) FROM cache'
+        ).fetchone()[0]
+        return totals
+
+    def close(self, **kwargs):
+        # Соединения живут в потоке, чтобы не открывать файл на каждый
+        # запрос; Django вызывает close() в конце каждого запроса.
+        pass
+
+
+class LocalTier:
+    """ LRU-словарь процесса со сроком записей и счётчиками. """
+
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self.counts = dict.fromkeys(STATS, 0)
+
+    def _check_fork(self):
+        # Копия родителя после fork могла устареть, счётчики — не наши.
+        if self._pid != os.getpid():
+            self._data.clear()
+            self.counts = dict.fromkeys(STATS, 0)
+            self._pid = os.getpid()
+
+    def get(self, key):
+        with self._lock:
+            self._check_fork()
+            item = self._data.get(key)
+            if item is not None and item[0] <= time.monotonic():
+                del self._data[key]
+                item = None
+            if item is None:
+                self.counts['misses'] += 1
+                return MISSING
+            self._data.move_to_end(key)
+            self.counts['hits'] += 1
+        _, value, pickled = item
+        return pickle.loads(value) if pickled else value
+
+    def set(self, key, value, timeout=None):
+        """ Кладёт на `LOCAL_TIMEOUT`, но не дольше `timeout` секунд. """
+        timeout = self.timeout if timeout is None else min(
+            timeout, self.timeout
+        )
+        if timeout <= 0:
+            self.delete(key)
+            return
+        pickled = type(value) not in IMMUTABLE
+        if pickled:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._check_fork()
+            self._data[key] = (time.monotonic() + timeout, value, pickled)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.counts['evictions'] += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, 'entries': len(self._data)}
+
+
+_tiers = {}
+_tiers_lock = threading.Lock()
+
+
+class TieredCache(BaseCache):
+    """ Локальный LRU процесса перед общим кэшем `LOCATION`. """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._shared_alias = location
+        self._bypass = tuple(options.get('BYPASS', BYPASS))
+        # Django заводит бэкенд в каждом потоке; уровень у них общий.
+        with _tiers_lock:
+            self._tier = _tiers.setdefault(location, LocalTier(
+                self._max_entries,
+                options.get('LOCAL_TIMEOUT', LOCAL_TIMEOUT),
+            ))
+
+    @property
+    def shared(self):
+        return caches[self._shared_alias]
+
+    def _local_key(self, key, version):
+        if str(key).startswith(self._bypass):
+            return None
+        return self.make_key(key, version=version)
+
+    def _local_timeout(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.shared.default_timeout
+        return timeout
+
+    def get(self, key, default=None, version=None):
+        found = self.get_many([key], version=version)
+        return found.get(key, default)
+
+    def get_many(self, keys, version=None):
+        begin = time.perf_counter()
+        found, rest = {}, []
+        for key in keys:
+            local_key = self._local_key(key, version)
+            value = MISSING if local_key is None else self._tier.get(local_key)
+            if value is MISSING:
+                rest.append(key)
+            else:
+                found[key] = value
+        if found:
+            instrumentation.record_cache(
+                len(found), 0, time.perf_counter() - begin, tier='local'
+            )
+        if rest:
+            shared = self.shared.get_many(rest, version=version)
+            for key, value in shared.items():
+                local_key = self._local_key(key, version)
+                if local_key is not None:
+                    self._tier.set(local_key, value)
+            found.update(shared)
+        return found
+
+    def has_key(self, key, version=None):
+        return self.get(key, MISSING, version=version) is not MISSING
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.shared.set(key, value, timeout, version=version)
+        local_key = self._local_key(key, version)
+        if local_key is not None:
+            self._tier.set(local_key, value, self._local_timeout(timeout))
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.shared.set_many(data, timeout, version=version)
+        for key, value in data.items():
+            local_key = self._local_key(key, version)
+            if local_key is not None and key not in failed:
+                self._tier.set(local_key, value, self._local_timeout(timeout))
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.shared.add(key, value, timeout, version=version)
+        local_key = self._local_key(key, version)
+        if added and local_key is not None:
+            self._tier.set(local_key, value, self._local_timeout(timeout))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.shared.touch(key, timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        local_key = self._local_key(key, version)
+        if local_key is not None:
+            self._tier.delete(local_key)
+        return self.shared.incr(key, delta, version=version)
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version=version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self._tier.delete(*filter(None, (
+            self._local_key(key, version) for key in keys
+        )))
+        self.shared.delete_many(keys, version=version)
+
+    def clear(self):
+        self._tier.clear()
+        self.shared.clear()
+
+    def stats(self):
+        """ Счётчики по уровням: локальный — этого процесса. """
+        shared = getattr(self.shared, 'stats', None)
+        return {
+            'local': self._tier.stats(),
+            'shared': shared() if shared else {},
+        }
@@ -0,0 +1,66 @@
+""" Чтение с реплик, запись в основную базу.
+
+    DATABASES = {'default': {...}, 'replica1': {...}}
+    DATABASE_REPLICAS = ['replica1']
+    DATABASE_ROUTERS = ['core.db.routers.PrimaryReplicaRouter']
+
+Запросы на чтение уходят на случайную реплику. После записи чтение
+в том же запросе идёт в основную базу, а `ReplicaStickinessMiddleware`
+закрепляет за ней и следующие запросы пользователя на время отставания
+реплик: пользователь сразу видит свой пост или комментарий.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_state = threading.local()
+
+
+def pin(wrote=False):
+    """ Направляет чтение текущего потока в основную базу. """
+    _state.pinned = True
+    _state.wrote = getattr(_state, 'wrote', False) or wrote
+
+
+def reset():
+    _state.pinned = _state.wrote = False
+
+
+def is_pinned():
+    return getattr(_state, 'pinned', False)
+
+
+def wrote():
+    """ Была ли запись в основную базу с последнего `reset`. """
+    return getattr(_state, 'wrote', False)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        # Внутри транзакции читается то, что она же записала.
+        if (not replicas or is_pinned()
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin(wrote=True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Реплики получают схему вместе с данными основной базы.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
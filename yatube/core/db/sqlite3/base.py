@@ -0,0 +1,89 @@
+""" SQLite для продакшена: WAL, настройки соединения, ожидание блокировок.
+
+    DATABASES = {
+        'default': {
+            'ENGINE': 'core.db.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': 600,
+            'OPTIONS': {
+                'timeout': 5,  # сколько SQLite ждёт блокировку, с
+                'busy_retries': 3,
+                'pragmas': {'mmap_size': 0},  # дополняют PRAGMAS
+            },
+        }
+    }
+
+В режиме WAL читатели не ждут писателя. Транзакции начинаются с
+`BEGIN IMMEDIATE`: блокировка записи берётся сразу и ждёт по `timeout`,
+а не падает при повышении чтения до записи посреди транзакции.
+Запрос вне транзакции, получивший `database is locked` после `timeout`,
+повторяется `busy_retries` раз с растущей паузой.
+"""
+import time
+
+from django.db.backends.sqlite3 import base
+
+Database = base.Database
+
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,  # в КиБ
+    'temp_store': 'MEMORY',
+}
+BUSY_RETRIES = 3
+BUSY_BACKOFF = 0.05
+
+
+def is_busy(error):
+    return 'locked' in str(error) or 'busy' in str(error)
+
+
+class SQLiteCursorWrapper(base.SQLiteCursorWrapper):
+    busy_retries = BUSY_RETRIES
+
+    def _retry(self, method, *args):
+        attempt = 0
+        while True:
+            try:
+                return method(*args)
+            except Database.OperationalError as error:
+                # Внутри транзакции повтор одного запроса не поможет:
+                # её откатит и повторит вызывающий код.
+                if (not is_busy(error) or self.connection.in_transaction
+                        or attempt >= self.busy_retries):
+                    raise
+                time.sleep(BUSY_BACKOFF * 2 ** attempt)
+                attempt += 1
+
+    def execute(self, query, params=None):
+        return self._retry(super().execute, query, params)
+
+    def executemany(self, query, param_list):
+        return self._retry(super().executemany, query, param_list)
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        options = self.settings_dict['OPTIONS']
+        self.pragmas = {**PRAGMAS, **options.get('pragmas', {})}
+        self.busy_retries = options.get('busy_retries', BUSY_RETRIES)
+        kwargs = super().get_connection_params()
+        kwargs.pop('pragmas', None)
+        kwargs.pop('busy_retries', None)
+        return kwargs
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def create_cursor(self, name=None):
+        cursor = self.connection.cursor(factory=SQLiteCursorWrapper)
+        cursor.busy_retries = self.busy_retries
+        return cursor
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
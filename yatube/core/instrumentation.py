@@ -0,0 +1,143 @@
+""" Замеры внутри запроса: база, шаблоны, кэш, пагинатор, миниатюры.
+
+`InstrumentationMiddleware` заводит на время запроса `Recorder` в
+локальной памяти потока. Запросы к базе считает `execute_wrapper`,
+рендеринг шаблонов — бэкенд `core.template_backends.DjangoTemplates`,
+обращения к кэшу — `core.cache_backends.SQLiteCache` и локальный
+уровень `TieredCache`. Вне запроса
+(команды, фоновые потоки) записывать некуда, и замеры ничего не стоят.
+"""
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import slow_queries
+
+_local = threading.local()
+
+
+class Recorder:
+    """ Время (с) и счётчики одного запроса. """
+
+    def __init__(self, request=None):
+        self.request = request
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self._active = set()
+        self._paused = False
+
+    @property
+    def view(self):
+        """ Имя URL запроса (`posts:index`) или None до разрешения. """
+        match = getattr(self.request, 'resolver_match', None)
+        return match.view_name if match else None
+
+    @contextmanager
+    def paused(self):
+        """ Служебные запросы (EXPLAIN) не входят в замеры. """
+        self._paused = True
+        try:
+            yield
+        finally:
+            self._paused = False
+
+    @contextmanager
+    def timer(self, name):
+        # Вложенный замер того же вида (шаблон внутри шаблона) уже
+        # входит во внешний.
+        if name in self._active:
+            yield
+            return
+        self._active.add(name)
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.perf_counter() - begin
+            self._active.discard(name)
+
+    def __call__(self, execute, sql, params, many, context):
+        """ Обёртка `connection.execute_wrapper`. """
+        if self._paused:
+            return execute(sql, params, many, context)
+        self.counts['db'] += 1
+        begin = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - begin
+        self.durations['db'] += duration
+        if duration * 1000 >= settings.SLOW_QUERY_MS:
+            slow_queries.record(
+                self, context['connection'], sql, params, many, duration
+            )
+        return result
+
+    def summary(self):
+        return {
+            'db_queries': self.counts['db'],
+            'db_ms': round(self.durations['db'] * 1000, 2),
+            'template_ms': round(self.durations['template'] * 1000, 2),
+            'cache_hits': self.counts['cache_hits'],
+            'cache_misses': self.counts['cache_misses'],
+            'cache_local_hits': self.counts['cache_local_hits'],
+            'cache_ms': round(self.durations['cache'] * 1000, 2),
+            'thumbnail_ms': round(self.durations['thumbnail'] * 1000, 2),
+            'paginator_ms': round(self.durations['paginator'] * 1000, 2),
+        }
+
+    def server_timing(self, total):
+        """ Значение заголовка Server-Timing. """
+        metrics = [
+            ('db', self.durations['db'], f'queries={self.counts["db"]}'),
+            ('template', self.durations['template'], None),
+            ('cache', self.durations['cache'],
+             f'hits={self.counts["cache_hits"]} '
+             f'local={self.counts["cache_local_hits"]} '
+             f'misses={self.counts["cache_misses"]}'),
+            ('thumbnail', self.durations['thumbnail'], None),
+            ('paginator', self.durations['paginator'], None),
+            ('total', total, None),
+        ]
+        return ', '.join(
+            f'{name};dur={duration * 1000:.2f}'
+            + (f';desc="{description}"' if description else '')
+            for name, duration, description in metrics
+            if duration or name in ('db', 'total')
+        )
+
+
+def start(request=None):
+    _local.recorder = Recorder(request)
+    return _local.recorder
+
+
+def stop():
+    _local.recorder = None
+
+
+def current():
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def timer(name):
+    """ Замер участка запроса; вне запроса ничего не делает. """
+    recorder = current()
+    if recorder is None:
+        yield
+        return
+    with recorder.timer(name):
+        yield
+
+
+def record_cache(hits, misses, duration, tier='shared'):
+    """ Обращение к кэшу; попадания локального уровня входят в общие. """
+    recorder = current()
+    if recorder is not None:
+        recorder.counts['cache_hits'] += hits
+        if tier == 'local':
+            recorder.counts['cache_local_hits'] += hits
+        recorder.counts['cache_misses'] += misses
+        recorder.durations['cache'] += duration
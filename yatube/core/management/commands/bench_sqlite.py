@@ -0,0 +1,176 @@
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connections, transaction
+from django.db.models import F
+from posts.models import Comment, Post, User
+
+from core.benchmark import percentile
+
+ENGINES = {
+    'django': 'django.db.backends.sqlite3',
+    'production': 'core.db.sqlite3',
+}
+CONNECT_SAMPLES = 50
+
+
+class Worker(threading.Thread):
+    """ Поток, который повторяет операцию до остановки бенчмарка. """
+
+    def __init__(self, alias, operation, stop):
+        super().__init__(daemon=True)
+        self.alias = alias
+        self.operation = operation
+        self.stop = stop
+        self.latencies = []
+        self.errors = 0
+
+    def run(self):
+        try:
+            while not self.stop.is_set():
+                begin = time.perf_counter()
+                try:
+                    self.operation(self.alias)
+                except OperationalError:
+                    self.errors += 1
+                    continue
+                self.latencies.append(time.perf_counter() - begin)
+        finally:
+            connections[self.alias].close()
+
+
+def read_page(alias):
+    list(Post.objects.using(alias).for_listing().order_by(
+        '-pub_date', '-pk'
+    )[:11])
+
+
+def make_writer(post_id, author_id):
+    def write_comment(alias):
+        # Та же работа, что у add_comment: строка и счётчик в транзакции.
+        with transaction.atomic(using=alias):
+            Comment.objects.using(alias).bulk_create([Comment(
+                post_id=post_id, author_id=author_id, text='Нагрузка',
+            )])
+            Post.objects.using(alias).filter(pk=post_id).update(
+                comments_count=F('comments_count') + 1
+            )
+    return write_comment
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает чтение страницы постов во время записи '
+            'комментариев на стандартном SQLite и в режиме core.db.sqlite3')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument(
+            '--duration', type=float, default=5,
+            help='Длительность замера каждого режима, с',
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=5,
+            help='Ожидание блокировки SQLite в обоих режимах, с',
+        )
+
+    def snapshot(self, path):
+        """ Копия базы по умолчанию в журнале отката (DELETE). """
+        source = connections['default']
+        if source.vendor != 'sqlite':
+            raise CommandError('Бенчмарк рассчитан на SQLite')
+        source.ensure_connection()
+        target = sqlite3.connect(path)
+        source.connection.backup(target)
+        target.execute('PRAGMA journal_mode = DELETE')
+        target.close()
+
+    def register(self, mode, path, timeout):
+        alias = f'bench_{mode}'
+        connections.databases[alias] = {
+            **connections.databases['default'],
+            'ENGINE': ENGINES[mode],
+            'NAME': path,
+            'OPTIONS': {'timeout': timeout},
+            'TEST': {},
+        }
+        connections.ensure_defaults(alias)
+        return alias
+
+    def connect_time(self, alias):
+        samples = []
+        for _ in range(CONNECT_SAMPLES):
+            begin = time.perf_counter()
+            connections[alias].ensure_connection()
+            samples.append(time.perf_counter() - begin)
+            connections[alias].close()
+        return statistics.median(samples)
+
+    def run_mode(self, alias, options, writer):
+        stop = threading.Event()
+        readers = [
+            Worker(alias, read_page, stop) for _ in range(options['readers'])
+        ]
+        writers = [
+            Worker(alias, writer, stop) for _ in range(options['writers'])
+        ]
+        for worker in readers + writers:
+            worker.start()
+        time.sleep(options['duration'])
+        stop.set()
+        for worker in readers + writers:
+            worker.join()
+        reads = [t for worker in readers for t in worker.latencies]
+        writes = [t for worker in writers for t in worker.latencies]
+        return {
+            'reads/s': len(reads) / options['duration'],
+            'read p50, мс': percentile(reads, 0.5) * 1000,
+            'read p99, мс': percentile(reads, 0.99) * 1000,
+            'writes/s': len(writes) / options['duration'],
+            'write p99, мс': percentile(writes, 0.99) * 1000,
+            'ошибки блокировки': sum(
+                worker.errors for worker in readers + writers
+            ),
+            'соединение, мс': self.connect_time(alias) * 1000,
+        }
+
+    def handle(self, *args, **options):
+        post = Post.objects.order_by('pk').first()
+        author = User.objects.order_by('pk').first()
+        if post is None or author is None:
+            raise CommandError(
+                'В базе нет постов, заполните её: explain_listings --seed'
+            )
+        writer = make_writer(post.pk, author.pk)
+        directory = tempfile.mkdtemp()
+        results = {}
+        try:
+            for mode in ENGINES:
+                path = os.path.join(directory, f'{mode}.sqlite3')
+                self.snapshot(path)
+                alias = self.register(mode, path, options['timeout'])
+                try:
+                    results[mode] = self.run_mode(alias, options, writer)
+                finally:
+                    connections[alias].close()
+                    del connections.databases[alias]
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        self.stdout.write(
+            f'Читателей: {options["readers"]}, '
+            f'писателей: {options["writers"]}, {options["duration"]} с'
+        )
+        self.stdout.write(f'{"":20}' + ''.join(
+            f'{mode:>12}' for mode in results
+        ))
+        for metric in results['django']:
+            self.stdout.write(f'{metric:20}' + ''.join(
+                f'{values[metric]:12.1f}' for values in results.values()
+            ))
@@ -0,0 +1,253 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth.tokens import default_token_generator
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from posts import synthetic
+from posts.models import Group, Post, User
+
+from core.benchmark import latency_summary
+
+# Пространства имён приложений сайта; админка и дубли contrib.auth
+# в замер не входят.
+NAMESPACES = ('posts', 'home', 'users', 'about')
+# Страницы, после которых клиент нужно снова авторизовать.
+LOGS_OUT = ('users:logout',)
+
+
+def url_names(resolver=None, namespace=None):
+    """ Имена (с пространством) и шаблоны путей страниц сайта. """
+    resolver = resolver or get_resolver()
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_names(pattern, pattern.namespace or namespace)
+        elif (isinstance(pattern, URLPattern) and pattern.name
+                and namespace in NAMESPACES):
+            yield f'{namespace}:{pattern.name}', pattern
+
+
+class Counter:
+    """ Считает запросы к базе без отладочного курсора. """
+
+    def __init__(self):
+        self.queries = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число запросов и размер ответа всех '
+            'страниц сайта на тестовой базе с синтетическими данными')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=5000)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument(
+            '--requests', type=int, default=50,
+            help='Замеров на страницу после прогрева',
+        )
+        parser.add_argument(
+            '--anonymous', action='store_true',
+            help='Запрашивать страницы как гость',
+        )
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Без кэша (DummyCache): стоимость полного рендеринга',
+        )
+        parser.add_argument(
+            '--json', metavar='PATH', help='Записать результаты в JSON',
+        )
+        parser.add_argument(
+            '--baseline', metavar='PATH',
+            help='JSON прошлого прогона для поиска регрессий',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help='Допустимый рост p95 относительно baseline, %%',
+        )
+
+    def handle(self, *args, **options):
+        directory = tempfile.mkdtemp()
+        if options['no_cache']:
+            caches = {'default': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            }}
+        else:
+            # Те же бэкенды, что у сайта, но отдельный файл: фрагменты
+            # синтетических данных не должны попасть в его кэш.
+            caches = {
+                **settings.CACHES,
+                'shared': {
+                    **settings.CACHES['shared'],
+                    'LOCATION': os.path.join(directory, 'cache.sqlite3'),
+                },
+            }
+        # Строки лога запросов смешались бы с отчётом.
+        logging.getLogger('core.middleware').setLevel(logging.WARNING)
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            with override_settings(
+                CACHES=caches,
+                DATABASE_REPLICAS=[],
+                MEDIA_ROOT=directory,
+                # Как в бою: гости получают страницы из кэша.
+                PAGE_CACHE_ENABLED=not options['no_cache'],
+            ):
+                dataset = self.seed(options)
+                results = self.run(options, dataset)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(directory, ignore_errors=True)
+
+        report = {
+            'meta': {
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                **{key: options[key] for key in (
+                    'posts', 'users', 'groups', 'random_seed', 'requests',
+                    'anonymous', 'no_cache',
+                )},
+            },
+            'views': results,
+        }
+        self.print_report(results)
+        if options['json']:
+            with open(options['json'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+        if options['baseline']:
+            self.compare(results, options['baseline'], options['threshold'])
+
+    def seed(self, options):
+        begin = time.monotonic()
+        synthetic.generate(
+            options['users'], options['groups'], options['posts'],
+            comments=options['posts'] * 2,
+            follows=options['users'] * 20,
+            seed=options['random_seed'],
+            with_timeline=True,
+        )
+        viewer = User.objects.order_by('-counters__following_count').first()
+        viewer.set_password('benchmark')
+        viewer.save()
+        post = viewer.posts.order_by('-comments_count').first() or (
+            Post.objects.order_by('-comments_count').first()
+        )
+        author = post.author if post.author != viewer else (
+            User.objects.exclude(pk=viewer.pk).first()
+        )
+        self.stdout.write(
+            f'Данные: {options["posts"]} постов за '
+            f'{time.monotonic() - begin:.1f} с'
+        )
+        return {
+            'viewer': viewer,
+            'kwargs': {
+                'slug': Group.objects.order_by('-posts_count').first().slug,
+                'username': author.username,
+                'post_id': post.pk,
+                'uidb64': urlsafe_base64_encode(force_bytes(viewer.pk)),
+                'token': default_token_generator.make_token(viewer),
+            },
+        }
+
+    def client(self, options, dataset):
+        client = Client()
+        if not options['anonymous']:
+            client.force_login(dataset['viewer'])
+        return client
+
+    def run(self, options, dataset):
+        results = {}
+        for name, pattern in url_names():
+            missing = set(pattern.pattern.converters) - set(dataset['kwargs'])
+            if missing:
+                raise CommandError(f'Нет параметров {missing} для {name}')
+            kwargs = {
+                key: dataset['kwargs'][key]
+                for key in pattern.pattern.converters
+            }
+            results[name] = self.measure(name, kwargs, options, dataset)
+        return results
+
+    def measure(self, name, kwargs, options, dataset):
+        address = reverse(name, kwargs=kwargs)
+        client = self.client(options, dataset)
+        latencies, counter = [], Counter()
+        cold = None
+        for _ in range(options['requests'] + 1):
+            if name in LOGS_OUT and not options['anonymous']:
+                client.force_login(dataset['viewer'])
+            counter.queries = 0
+            with connection.execute_wrapper(counter):
+                begin = time.perf_counter()
+                response = client.get(address)
+                elapsed = time.perf_counter() - begin
+            if cold is None:
+                cold = elapsed
+                continue
+            latencies.append(elapsed)
+        return {
+            'url': address,
+            'status': response.status_code,
+            'cold_ms': cold * 1000,
+            **latency_summary(latencies),
+            'queries': counter.queries,
+            'bytes': len(response.content),
+        }
+
+    def print_report(self, results):
+        columns = ('status', 'cold_ms', 'p50_ms', 'p95_ms', 'p99_ms',
+                   'queries', 'bytes')
+        self.stdout.write(f'{"":32}' + ''.join(
+            f'{column:>9}' for column in columns
+        ))
+        for name, result in results.items():
+            self.stdout.write(f'{name:32}' + ''.join(
+                f'{result[column]:9.1f}' if isinstance(result[column], float)
+                else f'{result[column]:9}'
+                for column in columns
+            ))
+
+    def compare(self, results, path, threshold):
+        with open(path) as file:
+            baseline = json.load(file)['views']
+        regressions = []
+        for name, result in results.items():
+            before = baseline.get(name)
+            if before is None:
+                continue
+            if result['p95_ms'] > before['p95_ms'] * (1 + threshold / 100):
+                regressions.append(
+                    f'{name}: p95 {before["p95_ms"]:.1f} -> '
+                    f'{result["p95_ms"]:.1f} мс'
+                )
+            if result['queries'] > before['queries']:
+                regressions.append(
+                    f'{name}: запросов {before["queries"]} -> '
+                    f'{result["queries"]}'
+                )
+        if regressions:
+            raise CommandError('Регрессии:\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
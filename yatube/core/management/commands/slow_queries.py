@@ -0,0 +1,50 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.slow_queries import aggregate, read
+
+
+class Command(BaseCommand):
+    help = ('Сводка журнала медленных запросов по отпечаткам: '
+            'суммарное время, число, страницы и план')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=None,
+            help='Журнал, по умолчанию SLOW_QUERY_LOG',
+        )
+        parser.add_argument('--top', type=int, default=10)
+        parser.add_argument(
+            '--json', action='store_true', help='Вывести сводку в JSON',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.SLOW_QUERY_LOG
+        try:
+            groups = aggregate(read(path))[:options['top']]
+        except FileNotFoundError:
+            raise CommandError(
+                f'Журнала {path} нет: медленных запросов не было'
+            )
+        if options['json']:
+            self.stdout.write(json.dumps(groups, ensure_ascii=False, indent=2))
+            return
+        for group in groups:
+            views = ', '.join(
+                f'{view} ×{count}' for view, count in sorted(
+                    group['views'].items(), key=lambda item: -item[1]
+                )
+            )
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'{group["fingerprint"]}: {group["count"]} раз, '
+                f'всего {group["total_ms"]:.1f} мс, '
+                f'в среднем {group["avg_ms"]:.1f} мс, '
+                f'максимум {group["max_ms"]:.1f} мс'
+            ))
+            self.stdout.write(f'  страницы: {views}')
+            self.stdout.write(f'  {group["sql"]}')
+            if group['plan']:
+                for line in group['plan'].splitlines():
+                    self.stdout.write(f'    {line}')
@@ -0,0 +1,42 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from core.cache import REPLICA_SCOPE, bump
+
+
+class Command(BaseCommand):
+    help = 'Обновляет локальные реплики SQLite копией основной базы'
+
+    def handle(self, *args, **options):
+        source = connections[DEFAULT_DB_ALIAS]
+        source.ensure_connection()
+        synced = 0
+        for alias in settings.DATABASE_REPLICAS:
+            replica = connections.databases[alias]
+            if (source.vendor != 'sqlite'
+                    or connections[alias].vendor != 'sqlite'):
+                self.stdout.write(
+                    f'{alias}: не SQLite, реплицируется средствами СУБД'
+                )
+                continue
+            begin = time.monotonic()
+            target = sqlite3.connect(replica['NAME'], timeout=30)
+            try:
+                # Онлайн-копия: запись в основную базу во время неё
+                # не останавливается.
+                source.connection.backup(target)
+            finally:
+                target.close()
+            synced += 1
+            self.stdout.write(
+                f'{alias}: {time.monotonic() - begin:.2f} с'
+            )
+        if synced:
+            bump(REPLICA_SCOPE)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обновлено реплик: {synced}'
+        ))
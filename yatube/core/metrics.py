@@ -0,0 +1,244 @@
+""" Метрики узла в текстовом формате Prometheus.
+
+Каждый процесс копит приращения в памяти и раз в `METRICS_FLUSH_INTERVAL`
+секунд складывает их в общий файл SQLite (`METRICS_PATH`), как
+`SQLiteCache` складывает статистику. Поэтому `/metrics` любого
+WSGI-воркера показывает сумму по всем процессам узла, отставая не больше
+чем на интервал сброса.
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS samples ('
+    ' name TEXT, labels TEXT, value REAL, PRIMARY KEY (name, labels))',
+)
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BOUND = re.compile(r'(?:^|,)le="([^"]*)"')
+# Семейства метрик: имя -> (тип, описание, границы корзин гистограммы).
+FAMILIES = {
+    'yatube_requests_total': (
+        'counter', 'Ответы по имени URL, методу и статусу', None,
+    ),
+    'yatube_request_duration_seconds': (
+        'histogram', 'Время ответа', LATENCY_BUCKETS,
+    ),
+    'yatube_db_queries': (
+        'histogram', 'Запросов к базе на ответ', QUERY_BUCKETS,
+    ),
+    'yatube_cache_hits_total': ('counter', 'Попадания в кэш', None),
+    'yatube_cache_misses_total': ('counter', 'Промахи кэша', None),
+    'yatube_cache_local_hits_total': (
+        'counter', 'Попадания в локальный уровень кэша процесса', None,
+    ),
+    'yatube_cache_hit_ratio': (
+        'gauge', 'Доля попаданий в кэш с момента запуска', None,
+    ),
+    'yatube_paginator_duration_seconds': (
+        'histogram', 'Выборка страницы списка', LATENCY_BUCKETS,
+    ),
+    'yatube_thumbnail_duration_seconds': (
+        'histogram', 'Создание миниатюр одной картинки', LATENCY_BUCKETS,
+    ),
+}
+
+
+def _labels(labels):
+    return ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'),
+        )
+        for name, value in sorted(labels.items())
+    )
+
+
+class Store:
+    """ Приращения процесса и общий файл узла. """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = defaultdict(float)
+        self._pid = os.getpid()
+        self._flushed = time.monotonic()
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None,
+                check_same_thread=False,
+            )
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                db.execute(statement)
+            self._local.db, self._local.pid = db, os.getpid()
+        return db
+
+    def _add(self, items):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Приращения родителя после fork уже не наши.
+                self._pending.clear()
+                self._pid = os.getpid()
+            for key, amount in items:
+                self._pending[key] += amount
+            due = (
+                time.monotonic() - self._flushed
+                >= settings.METRICS_FLUSH_INTERVAL
+            )
+        if due:
+            self.flush()
+
+    def add(self, name, labels, amount=1):
+        self._add([((name, _labels(labels)), amount)])
+
+    def observe(self, name, labels, value):
+        """ Наблюдение гистограммы: корзины, сумма и число. """
+        items = [
+            ((f'{name}_bucket', _labels({**labels, 'le': bound})), 1)
+            for bound in (*FAMILIES[name][2], '+Inf')
+            if bound == '+Inf' or value <= bound
+        ]
+        items += [
+            ((f'{name}_sum', _labels(labels)), value),
+            ((f'{name}_count', _labels(labels)), 1),
+        ]
+        self._add(items)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(float)
+            self._flushed = time.monotonic()
+        if not pending:
+            return
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany(
+                'INSERT OR IGNORE INTO samples VALUES (?, ?, 0)',
+                list(pending),
+            )
+            db.executemany(
+                'UPDATE samples SET value = value + ? '
+                'WHERE name = ? AND labels = ?',
+                [(value, *key) for key, value in pending.items()],
+            )
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+
+    def samples(self):
+        self.flush()
+        return self._db.execute(
+            'SELECT name, labels, value FROM samples ORDER BY name, labels'
+        ).fetchall()
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+        self._db.execute('DELETE FROM samples')
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None or _store.path != settings.METRICS_PATH:
+            _store = Store(settings.METRICS_PATH)
+        return _store
+
+
+def _family(sample):
+    for suffix in ('_bucket', '_sum', '_count'):
+        if sample.endswith(suffix) and sample[:-len(suffix)] in FAMILIES:
+            return sample[:-len(suffix)]
+    return sample
+
+
+def _order(sample):
+    """ Порядок строк: корзины гистограммы по возрастанию границы. """
+    name, labels, _ = sample
+    match = BOUND.search(labels)
+    if match is None:
+        return name, labels, 0
+    return name, BOUND.sub('', labels), float(match.group(1))
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+def _hit_ratios(samples):
+    totals = defaultdict(lambda: [0, 0])
+    for name, labels, value in samples:
+        if name == 'yatube_cache_hits_total':
+            totals[labels][0] += value
+        elif name == 'yatube_cache_misses_total':
+            totals[labels][1] += value
+    return [
+        ('yatube_cache_hit_ratio', labels, hits / (hits + misses))
+        for labels, (hits, misses) in sorted(totals.items())
+        if hits + misses
+    ]
+
+
+def observe_request(view, method, status, duration, recorder):
+    """ Метрики ответа по замерам `core.instrumentation.Recorder`. """
+    store = get_store()
+    labels = {'view': view or 'unresolved'}
+    store.add('yatube_requests_total', {
+        **labels, 'method': method, 'status': status,
+    })
+    store.observe('yatube_request_duration_seconds', labels, duration)
+    store.observe('yatube_db_queries', labels, recorder.counts['db'])
+    for result in ('hits', 'misses', 'local_hits'):
+        amount = recorder.counts[f'cache_{result}']
+        if amount:
+            store.add(f'yatube_cache_{result}_total', labels, amount)
+    paginator = recorder.durations.get('paginator')
+    if paginator:
+        store.observe('yatube_paginator_duration_seconds', labels, paginator)
+
+
+def observe_thumbnail(duration):
+    get_store().observe('yatube_thumbnail_duration_seconds', {}, duration)
+
+
+def render():
+    """ Все метрики узла в текстовом формате Prometheus 0.0.4. """
+    samples = get_store().samples()
+    samples += _hit_ratios(samples)
+    by_family = defaultdict(list)
+    for name, labels, value in samples:
+        by_family[_family(name)].append((name, labels, value))
+    lines = []
+    for family, (kind, description, _) in FAMILIES.items():
+        rows = by_family.get(family)
+        if not rows:
+            continue
+        lines += [f'# HELP {family} {description}', f'# TYPE {family} {kind}']
+        lines += [
+            f'{name}{{{labels}}} {_number(value)}' if labels
+            else f'{name} {_number(value)}'
+            for name, labels, value in sorted(rows, key=_order)
+        ]
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,114 @@
+import json
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import instrumentation, metrics, page_cache, profiling
+from .db import routers
+
+logger = logging.getLogger(__name__)
+
+STICKY_COOKIE = 'pin_primary'
+
+
+class ReplicaStickinessMiddleware:
+    """ Чтение своих записей при чтении с реплик.
+
+    Запрос, который писал в основную базу, ставит короткую куку; пока она
+    жива, чтение этого пользователя не уходит на отстающие реплики.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.reset()
+        if request.COOKIES.get(STICKY_COOKIE):
+            routers.pin()
+        try:
+            response = self.get_response(request)
+            if routers.wrote():
+                response.set_cookie(
+                    STICKY_COOKIE, '1',
+                    max_age=settings.REPLICA_STICKY_SECONDS,
+                    httponly=True,
+                    samesite='Lax',
+                )
+        finally:
+            routers.reset()
+        return response
+
+
+class InstrumentationMiddleware:
+    """ Время базы, шаблонов и кэша в заголовке Server-Timing, в логе
+    и в метриках узла (`core.metrics`).
+
+    Стоит первым в MIDDLEWARE, чтобы `total` включал остальные
+    промежуточные слои. На каждый запрос к базе добавляется один вызов
+    обёртки и два `perf_counter`, поэтому слой включён и в бою.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = instrumentation.start(request)
+        begin = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(recorder))
+                response = self.get_response(request)
+        finally:
+            instrumentation.stop()
+        total = time.perf_counter() - begin
+        response['Server-Timing'] = recorder.server_timing(total)
+        view = recorder.view
+        metrics.observe_request(
+            view, request.method, response.status_code, total, recorder
+        )
+        logger.info(json.dumps({
+            'view': view,
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            **recorder.summary(),
+        }, ensure_ascii=False))
+        return response
+
+
+class ProfilingMiddleware:
+    """ Профиль запроса по `?_profile=cpu|memory` от сотрудника.
+
+    Стоит после AuthenticationMiddleware: проверяется `is_staff`.
+    Остальные запросы проходят без профилировщика.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = profiling.requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        return profiling.capture(request, self.get_response, mode)
+
+
+class PageCacheMiddleware:
+    """ Страницы гостей из кэша, без представлений и шаблонов.
+
+    Стоит после AuthenticationMiddleware. Кэшируются только страницы,
+    помеченные представлением (`page_cache.mark`).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not page_cache.applies(request):
+            return self.get_response(request)
+        return page_cache.respond(request, self.get_response)
@@ -0,0 +1,102 @@
+""" Кэш целых страниц для гостей.
+
+Представление помечает страницу областями данных (`mark`), теми же, по
+которым считает ETag. Ответ хранится в `core.cache.Entry` вместе с
+поколениями этих областей; запись поста, комментария или подписки
+сдвигает поколение (`core.cache.invalidate`), и запись устаревает.
+Устаревшую страницу пересобирает один запрос под блокировкой, а
+остальные пока получают прежнюю (`X-Page-Cache: stale`).
+
+Ответ, который нельзя закэшировать (страница не помечена, форма с
+CSRF-токеном, 404 удалённого поста), заменяет запись пометкой с
+`value=None` на `UNCACHEABLE_TIMEOUT`: прежняя страница больше не
+отдаётся, а запросы по этому адресу идут прямо в представление, без
+блокировки и ожидания.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.translation import get_language
+
+from .cache import fetch, lock, store, wait
+
+KEY = 'page:{}'
+# Сколько адрес считается некэшируемым после такого ответа, с.
+UNCACHEABLE_TIMEOUT = 30
+
+
+def mark(request, scopes, versions):
+    """ Страницу можно закэшировать с поколениями `versions`. """
+    request._page_cache = (tuple(scopes), list(versions))
+
+
+def _key(request):
+    raw = f'{get_language()}:{request.get_full_path()}'
+    return KEY.format(hashlib.md5(raw.encode()).hexdigest())
+
+
+def applies(request):
+    """ Только GET/HEAD гостя без сообщений для показа. """
+    return (
+        settings.PAGE_CACHE_ENABLED
+        and request.method in ('GET', 'HEAD')
+        and not request.user.is_authenticated
+        and not request.COOKIES.get('messages')
+    )
+
+
+def _cacheable(request, response):
+    session = getattr(request, 'session', None)
+    return not (
+        getattr(request, '_page_cache', None) is None
+        or response.status_code != 200
+        or response.streaming
+        or response.cookies
+        # Форма с CSRF-токеном или новая сессия — страница не общая.
+        or request.META.get('CSRF_COOKIE_USED')
+        or (session is not None and session.modified)
+    )
+
+
+def _render(request, get_response, key):
+    begin = time.monotonic()
+    response = get_response(request)
+    if _cacheable(request, response):
+        scopes, versions = request._page_cache
+        store(
+            key, response, settings.PAGE_CACHE_TIMEOUT,
+            time.monotonic() - begin, scopes, versions,
+        )
+        response['X-Page-Cache'] = 'miss'
+    else:
+        store(key, None, UNCACHEABLE_TIMEOUT)
+    return response
+
+
+def _cached(request, entry, state):
+    response = entry.value
+    response['X-Page-Cache'] = state
+    return get_conditional_response(
+        request, etag=response.get('ETag'), response=response
+    )
+
+
+def respond(request, get_response):
+    """ Ответ из кэша или от представления; пересобирает один запрос. """
+    key = _key(request)
+    entry = fetch(key)
+    if entry is not None and entry.value is None and not entry.stale():
+        return get_response(request)
+    if entry is not None and not entry.stale() and not entry.due():
+        return _cached(request, entry, 'hit')
+    with lock(key) as acquired:
+        if acquired:
+            return _render(request, get_response, key)
+    state = 'stale'
+    if entry is None:
+        entry, state = wait(key), 'hit'
+    if entry is None or entry.value is None:
+        return get_response(request)
+    return _cached(request, entry, state)
@@ -0,0 +1,146 @@
+""" Профилирование отдельных запросов по просьбе сотрудника.
+
+Сотрудник (`is_staff`) добавляет к любому адресу `?_profile=cpu` (или
+заголовок `X-Profile: cpu`), и запрос выполняется под `cProfile`;
+`memory` дополнительно включает `tracemalloc`. Снимок (`.prof` и
+описание `.json`) кладётся в `PROFILING_DIR`, хранятся последние
+`PROFILING_KEEP`. Смотреть их — на странице `core:profiles`.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import re
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+
+PARAM = '_profile'
+HEADER = 'HTTP_X_PROFILE'
+MODES = ('cpu', 'memory')
+NAME = re.compile(r'^[\w-]+$')
+MEMORY_TOP = 20
+
+
+def requested_mode(request):
+    """ Режим профилирования запроса или None. """
+    mode = request.GET.get(PARAM) or request.META.get(HEADER)
+    if mode not in MODES:
+        return None
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_staff:
+        return None
+    return mode
+
+
+def _memory_top(snapshot):
+    return [
+        {'line': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1),
+         'count': stat.count}
+        for stat in snapshot.statistics('lineno')[:MEMORY_TOP]
+    ]
+
+
+def _rotate(directory):
+    captures = sorted(
+        name for name in os.listdir(directory) if name.endswith('.json')
+    )
+    for name in captures[:max(len(captures) - settings.PROFILING_KEEP, 0)]:
+        stem = name[:-len('.json')]
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, stem + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def capture(request, get_response, mode):
+    """ Выполняет запрос под профилировщиком и сохраняет снимок. """
+    profiler = cProfile.Profile()
+    tracing = mode == 'memory' and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    begin = time.perf_counter()
+    profiler.enable()
+    try:
+        response = get_response(request)
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - begin
+        memory = None
+        if tracing:
+            memory = _memory_top(tracemalloc.take_snapshot())
+            tracemalloc.stop()
+
+    directory = settings.PROFILING_DIR
+    os.makedirs(directory, exist_ok=True)
+    match = request.resolver_match
+    view = match.view_name if match else None
+    # Имя начинается со времени, поэтому сортировка имён — хронология.
+    name = '{}-{}-{}'.format(
+        datetime.now().strftime('%Y%m%d-%H%M%S-%f'),
+        re.sub(r'\W', '_', view or 'unresolved'),
+        uuid.uuid4().hex[:6],
+    )
+    profiler.dump_stats(os.path.join(directory, f'{name}.prof'))
+    with open(os.path.join(directory, f'{name}.json'), 'w') as file:
+        json.dump({
+            'name': name,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'view': view,
+            'path': request.get_full_path(),
+            'user': request.user.get_username(),
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 2),
+            'mode': mode,
+            'memory': memory,
+        }, file, ensure_ascii=False)
+    _rotate(directory)
+    response['X-Profile-Id'] = name
+    return response
+
+
+def captures():
+    """ Описания снимков, новые первыми. """
+    directory = settings.PROFILING_DIR
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as file:
+                result.append(json.load(file))
+    return result
+
+
+def _location(filename, line, function):
+    if filename.startswith(settings.BASE_DIR):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    return f'{filename}:{line}({function})'
+
+
+def load(name, limit=40):
+    """ Описание и топ функций по накопленному времени или None. """
+    if not NAME.match(name):
+        return None
+    path = os.path.join(settings.PROFILING_DIR, name)
+    if not os.path.exists(f'{path}.json'):
+        return None
+    with open(f'{path}.json') as file:
+        meta = json.load(file)
+    stats = pstats.Stats(f'{path}.prof', stream=io.StringIO())
+    rows = []
+    for (filename, line, function), (_, calls, own, cumulative, _) in sorted(
+        stats.stats.items(), key=lambda item: item[1][3], reverse=True
+    )[:limit]:
+        rows.append({
+            'function': _location(filename, line, function),
+            'calls': calls,
+            'own_ms': own * 1000,
+            'cumulative_ms': cumulative * 1000,
+        })
+    return {**meta, 'functions': rows}
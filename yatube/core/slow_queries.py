@@ -0,0 +1,128 @@
+""" Журнал медленных запросов к базе.
+
+Обёртка запросов `core.instrumentation.Recorder` передаёт сюда запросы
+дольше `SLOW_QUERY_MS`. Запись — строка JSON в логгере
+`core.slow_queries` (в настройках он пишет в файл `SLOW_QUERY_LOG`):
+SQL, параметры, длительность, имя URL, стек вызова из кода проекта
+и план запроса. Отпечаток (`fingerprint`) одинаков у запросов,
+различающихся только значениями, по нему команда `slow_queries`
+сводит журнал.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+import traceback
+
+from django.conf import settings
+from django.db import DatabaseError
+
+logger = logging.getLogger(__name__)
+
+STACK_DEPTH = 8
+EXPLAINABLE = ('SELECT', 'WITH')
+NORMALIZE = (
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'\s+'), ' '),
+)
+
+
+def normalize(sql):
+    """ SQL без значений: литералы и списки IN сворачиваются. """
+    for pattern, replacement in NORMALIZE:
+        sql = pattern.sub(replacement, sql)
+    return sql.strip()
+
+
+def fingerprint(sql):
+    return hashlib.md5(normalize(sql).encode()).hexdigest()[:16]
+
+
+def stack_summary():
+    """ Последние кадры стека из кода проекта, без этого модуля. """
+    base = settings.BASE_DIR + os.sep
+    skip = (__file__, os.path.join(os.path.dirname(__file__),
+                                   'instrumentation.py'))
+    frames = [
+        f'{frame.filename[len(base):]}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(base) and frame.filename not in skip
+    ]
+    return frames[-STACK_DEPTH:]
+
+
+def explain(recorder, connection, sql, params):
+    """ План запроса или None, если его не снять. """
+    if not sql.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    prefix = connection.ops.explain_query_prefix()
+    try:
+        with recorder.paused(), connection.cursor() as cursor:
+            cursor.execute(f'{prefix} {sql}', params)
+            return '\n'.join(
+                ' '.join(str(column) for column in row)
+                for row in cursor.fetchall()
+            )
+    except DatabaseError:
+        return None
+
+
+def record(recorder, connection, sql, params, many, duration):
+    request = recorder.request
+    entry = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'fingerprint': fingerprint(sql),
+        'duration_ms': round(duration * 1000, 2),
+        'view': recorder.view,
+        'path': getattr(request, 'path', None),
+        'database': connection.alias,
+        'sql': sql,
+        'params': None if many else [str(param) for param in params or ()],
+        'stack': stack_summary(),
+        'plan': None,
+    }
+    if settings.SLOW_QUERY_EXPLAIN and not many:
+        entry['plan'] = explain(recorder, connection, sql, params)
+    logger.warning(json.dumps(entry, ensure_ascii=False))
+    return entry
+
+
+def read(path):
+    """ Записи журнала; битые строки (обрыв записи) пропускаются. """
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def aggregate(entries):
+    """ Сводка по отпечаткам, самые затратные — первыми. """
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(entry['fingerprint'], {
+            'fingerprint': entry['fingerprint'],
+            'sql': normalize(entry['sql']),
+            'count': 0,
+            'total_ms': 0,
+            'max_ms': 0,
+            'views': {},
+            'plan': None,
+        })
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        view = entry['view'] or '-'
+        group['views'][view] = group['views'].get(view, 0) + 1
+        group['plan'] = entry['plan'] or group['plan']
+    for group in groups.values():
+        group['avg_ms'] = group['total_ms'] / group['count']
+    return sorted(
+        groups.values(), key=lambda group: group['total_ms'], reverse=True
+    )
@@ -0,0 +1,44 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+from django.templatetags.cache import CacheNode
+
+from ..cache import get_or_set
+
+register = template.Library()
+
+
+class FragmentNode(CacheNode):
+    def render(self, context):
+        try:
+            timeout = self.expire_time_var.resolve(context)
+        except template.VariableDoesNotExist:
+            raise template.TemplateSyntaxError(
+                f'"fragment" tag got an unknown variable: '
+                f'{self.expire_time_var.var!r}'
+            )
+        if timeout is not None:
+            timeout = int(timeout)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        return get_or_set(
+            make_template_fragment_key(self.fragment_name, vary_on),
+            lambda: self.nodelist.render(context),
+            timeout,
+        )
+
+
+@register.tag('fragment')
+def do_fragment(parser, token):
+    """ Как `{% cache timeout name vary_on... %}`, но через
+    `core.cache.get_or_set`: без лавины пересчётов при истечении.
+    """
+    nodelist = parser.parse(('endfragment',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            f'{tokens[0]!r} tag requires at least 2 arguments.'
+        )
+    return FragmentNode(
+        nodelist, parser.compile_filter(tokens[1]), tokens[2],
+        [parser.compile_filter(token) for token in tokens[3:]], None,
+    )
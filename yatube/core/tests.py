@@ -1,5 +1,35 @@
-from django.test import TestCase
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.urls import reverse
 from http import HTTPStatus
+from posts.models import Comment, Follow, Post, User
+
+from . import (instrumentation, metrics, page_cache, profiling,
+               slow_queries)
+from .benchmark import latency_summary, percentile
+from .cache import (LOCK_KEY, Entry, bump, fragment_key, generations,
+                    get_or_set, store)
+from .cache_backends import LocalTier, SQLiteCache
+from .db import routers
+from .db.sqlite3.base import DatabaseWrapper
+from .management.commands import benchmark_views
+from .middleware import STICKY_COOKIE, ReplicaStickinessMiddleware
 
 
 class ViewTestClass(TestCase):
@@ -7,3 +37,727 @@ class ViewTestClass(TestCase):
         response = self.client.get('/nonexist-page/')
         self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class GenerationTestClass(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_bump_changes_only_its_scope(self):
+        posts, group = generations('posts', 'group:1')
+        bump('posts')
+        self.assertEqual(generations('posts', 'group:1'), [posts + 1, group])
+
+    def test_fragment_key_survives_eviction(self):
+        key = fragment_key('index', 1, scopes=['posts'])
+        self.assertEqual(key, fragment_key('index', 1, scopes=['posts']))
+        cache.clear()
+        bump('posts')
+        self.assertNotEqual(key, fragment_key('index', 1, scopes=['posts']))
+
+
+class DogpileTestClass(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = []
+
+    def compute(self, value='новое'):
+        self.calls.append(value)
+        return value
+
+    def test_computes_once(self):
+        for _ in range(3):
+            self.assertEqual(get_or_set('key', self.compute, 60), 'новое')
+        self.assertEqual(self.calls, ['новое'])
+
+    def test_stale_served_while_locked(self):
+        store('key', 'старое', 60)
+        bump('posts')
+        store('key', 'старое', 60, scopes=['posts'],
+              versions=[generations('posts')[0] - 1])
+        cache.add(LOCK_KEY.format('key'), 1)
+        self.assertEqual(get_or_set('key', self.compute, 60), 'старое')
+        self.assertEqual(self.calls, [])
+        cache.delete(LOCK_KEY.format('key'))
+        self.assertEqual(get_or_set('key', self.compute, 60), 'новое')
+
+    def test_miss_waits_for_other_worker(self):
+        cache.add(LOCK_KEY.format('key'), 1)
+        worker = threading.Timer(0.1, store, ('key', 'чужое', 60))
+        worker.start()
+        self.assertEqual(get_or_set('key', self.compute, 60), 'чужое')
+        worker.join()
+        self.assertEqual(self.calls, [])
+
+    def test_released_lock_stops_waiting(self):
+        cache.add(LOCK_KEY.format('key'), 1)
+        worker = threading.Timer(
+            0.1, cache.delete, (LOCK_KEY.format('key'),)
+        )
+        worker.start()
+        begin = time.monotonic()
+        self.assertEqual(get_or_set('key', self.compute, 60), 'новое')
+        worker.join()
+        self.assertLess(time.monotonic() - begin, 1)
+
+    def test_early_refresh(self):
+        entry = Entry('value', 100, 10, (), [])
+        # Сдвиг при rand = 0.5: 10 * ln 2 ≈ 6.9 с до истечения.
+        with mock.patch('core.cache.random.random', return_value=0.5):
+            self.assertTrue(entry.due(now=95))
+            self.assertFalse(entry.due(now=90))
+            with override_settings(CACHE_EARLY_BETA=0):
+                self.assertFalse(entry.due(now=99.99))
+        self.assertTrue(entry.stale(now=100))
+        self.assertFalse(entry.stale(now=99))
+
+
+def _increment(path, times):
+    shared = SQLiteCache(path, {})
+    for _ in range(times):
+        shared.incr('counter')
+
+
+def _observe(path, count):
+    store = metrics.Store(path)
+    for _ in range(count):
+        store.observe('yatube_db_queries', {'view': 'posts:index'}, 3)
+    store.flush()
+
+
+class SQLiteCacheTestClass(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {'OPTIONS': {'MAX_ENTRIES': 4}})
+
+    def test_shared_between_instances(self):
+        self.cache.set('key', {'value': 1})
+        other = SQLiteCache(self.path, {})
+        self.assertEqual(other.get('key'), {'value': 1})
+        self.assertFalse(other.add('key', 'другое'))
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_expiry(self):
+        self.cache.set('key', 'value', timeout=0.05)
+        self.assertTrue(self.cache.has_key('key'))
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertTrue(self.cache.add('key', 'new'))
+
+    def test_lru_eviction(self):
+        for i in range(4):
+            self.cache.set(i, i)
+        self.cache._db.execute(
+            'UPDATE cache SET accessed = 0 WHERE key != ?',
+            (self.cache.make_key(0),)
+        )
+        self.cache.set('new', 'value')
+        self.assertEqual(self.cache.get(0), 0)
+        self.assertEqual(self.cache.get('new'), 'value')
+        self.assertLessEqual(self.cache.stats()['entries'], 4)
+        self.assertGreater(self.cache.stats()['evictions'], 0)
+
+    def test_atomic_incr_across_processes(self):
+        self.cache.set('counter', 0)
+        workers = [
+            multiprocessing.Process(target=_increment, args=(self.path, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(self.cache.get('counter'), 200)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_stats(self):
+        self.cache.set('key', 'value')
+        self.cache.get('key')
+        self.cache.get_many(['key', 'missing'])
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 1))
+
+    def test_tests_do_not_touch_project_cache(self):
+        location = caches['shared']._path
+        self.assertFalse(location.startswith(settings.BASE_DIR))
+
+
+class TieredCacheTestClass(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_hot_key_served_locally(self):
+        cache.set('hot', ['значение'])
+        caches['shared'].delete('hot')
+        value = cache.get('hot')
+        self.assertEqual(value, ['значение'])
+        value.append('изменение')
+        self.assertEqual(cache.get('hot'), ['значение'])
+
+    def test_generations_and_locks_bypass_local_tier(self):
+        for key in ('generation:posts', 'lock:page'):
+            with self.subTest(key=key):
+                cache.set(key, 1)
+                caches['shared'].set(key, 2)
+                self.assertEqual(cache.get(key), 2)
+
+    def test_writes_go_through(self):
+        cache.set('key', 'value')
+        self.assertEqual(caches['shared'].get('key'), 'value')
+        cache.delete('key')
+        self.assertIsNone(cache.get('key'))
+
+    def test_stats_per_tier(self):
+        before = cache.stats()['local']
+        cache.set('key', 'value')
+        cache.get('key')
+        cache.get('missing')
+        stats = cache.stats()
+        self.assertEqual(stats['local']['hits'] - before['hits'], 1)
+        self.assertEqual(stats['local']['misses'] - before['misses'], 1)
+        self.assertIn('hits', stats['shared'])
+
+    def test_local_tier_bounded_with_ttl(self):
+        tier = LocalTier(max_entries=2, timeout=0.05)
+        for key in ('a', 'b', 'c'):
+            tier.set(key, key)
+        self.assertEqual(tier.stats()['entries'], 2)
+        self.assertEqual(tier.stats()['evictions'], 1)
+        self.assertEqual(tier.get('c'), 'c')
+        time.sleep(0.1)
+        self.assertIsNot(tier.get('c'), 'c')
+
+
+class SQLiteBackendTestClass(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'db.sqlite3')
+
+    def wrapper(self, **options):
+        database = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': self.path,
+            'OPTIONS': options,
+        }, alias='backend_test')
+        self.addCleanup(database.close)
+        return database
+
+    def test_pragmas(self):
+        database = self.wrapper(pragmas={'cache_size': -1024})
+        with database.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone(), ('wal',))
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone(), (1,))
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone(), (-1024,))
+
+    def lock_for(self, seconds):
+        """ Держит блокировку записи из другого соединения. """
+        other = sqlite3.connect(self.path, check_same_thread=False)
+        other.isolation_level = None
+        other.execute('BEGIN IMMEDIATE')
+        release = threading.Timer(seconds, other.execute, ['COMMIT'])
+        release.start()
+        self.addCleanup(other.close)
+        self.addCleanup(release.join)
+
+    def test_busy_retry(self):
+        database = self.wrapper(timeout=0.01, busy_retries=5)
+        with database.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+        self.lock_for(0.2)
+        with database.cursor() as cursor:
+            cursor.execute('INSERT INTO item VALUES (1)')
+
+    def test_busy_without_retries(self):
+        database = self.wrapper(timeout=0.01, busy_retries=0)
+        with database.cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id INTEGER PRIMARY KEY)')
+        self.lock_for(0.2)
+        with self.assertRaises(OperationalError):
+            with database.cursor() as cursor:
+                cursor.execute('INSERT INTO item VALUES (1)')
+
+
+class BenchSQLiteTestClass(TransactionTestCase):
+    # Копия базы снимается через backup, он ждёт открытую транзакцию
+    # TestCase.
+    def test_reports_both_engines(self):
+        Post.objects.create(
+            author=User.objects.create_user(username='bench'), text='Пост'
+        )
+        out = StringIO()
+        call_command(
+            'bench_sqlite', readers=1, writers=1, duration=0.2, stdout=out
+        )
+        output = out.getvalue()
+        self.assertIn('production', output)
+        self.assertIn('reads/s', output)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTestClass(SimpleTestCase):
+    def setUp(self):
+        routers.reset()
+        self.addCleanup(routers.reset)
+        self.router = routers.PrimaryReplicaRouter()
+
+    def test_reads_go_to_replica_until_write(self):
+        self.assertEqual(self.router.db_for_read(Post), 'replica')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_replicas_are_not_migrated(self):
+        self.assertFalse(self.router.allow_migrate('replica', 'posts'))
+        self.assertIsNone(self.router.allow_migrate('default', 'posts'))
+
+    def middleware(self, view, **cookies):
+        request = RequestFactory().get('/')
+        request.COOKIES.update(cookies)
+        return ReplicaStickinessMiddleware(view)(request)
+
+    def test_write_sets_sticky_cookie(self):
+        def view(request):
+            self.router.db_for_write(Post)
+            return HttpResponse()
+
+        response = self.middleware(view)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        self.assertFalse(routers.is_pinned())
+
+    def test_sticky_cookie_pins_reads(self):
+        databases = []
+
+        def view(request):
+            databases.append(self.router.db_for_read(Post))
+            return HttpResponse()
+
+        response = self.middleware(view, **{STICKY_COOKIE: '1'})
+        self.middleware(view)
+        self.assertEqual(databases, ['default', 'replica'])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+
+class SyncReplicasTestClass(TransactionTestCase):
+    # Копия снимается через backup, он ждёт открытую транзакцию TestCase.
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        connections.databases['replica_test'] = {
+            **connection.settings_dict,
+            'NAME': os.path.join(directory.name, 'replica.sqlite3'),
+        }
+        self.addCleanup(connections.databases.pop, 'replica_test')
+        self.addCleanup(lambda: connections['replica_test'].close())
+        routers.reset()
+        self.addCleanup(routers.reset)
+
+    @override_settings(DATABASE_REPLICAS=['replica_test'])
+    def test_read_your_writes(self):
+        Post.objects.create(
+            author=User.objects.create_user(username='author'), text='Пост'
+        )
+        call_command('sync_replicas', stdout=StringIO())
+        routers.reset()
+        Post.objects.create(author=User.objects.get(), text='Ещё')
+        self.assertEqual(Post.objects.count(), 2)
+        routers.reset()
+        self.assertEqual(Post.objects.count(), 1)
+
+
+class BenchmarkViewsTestClass(SimpleTestCase):
+    def test_percentiles(self):
+        values = [n / 1000 for n in range(1, 101)]
+        self.assertEqual(percentile(values, 0.5), 0.051)
+        self.assertEqual(percentile([], 0.99), 0)
+        self.assertAlmostEqual(latency_summary(values)['p99_ms'], 100)
+
+    def test_site_urls_are_covered(self):
+        names = dict(benchmark_views.url_names())
+        for name in ('posts:index', 'posts:post_detail', 'home:index',
+                     'users:login', 'about:tech'):
+            self.assertIn(name, names)
+        self.assertFalse(any(name.startswith('admin:') for name in names))
+
+    def test_regressions_against_baseline(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'baseline.json')
+        with open(path, 'w') as file:
+            json.dump({'views': {
+                'posts:index': {'p95_ms': 10, 'queries': 3},
+            }}, file)
+        command = benchmark_views.Command(stdout=StringIO())
+        command.compare(
+            {'posts:index': {'p95_ms': 11, 'queries': 3}}, path, 20
+        )
+        with self.assertRaisesMessage(CommandError, 'запросов 3 -> 4'):
+            command.compare(
+                {'posts:index': {'p95_ms': 11, 'queries': 4}}, path, 20
+            )
+        with self.assertRaisesMessage(CommandError, 'p95 10.0 -> 13.0'):
+            command.compare(
+                {'posts:index': {'p95_ms': 13, 'queries': 3}}, path, 20
+            )
+
+
+class InstrumentationTestClass(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing_header(self):
+        response = self.client.get('/')
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'template;dur=', 'cache;dur=',
+                       'total;dur='):
+            self.assertIn(metric, timing)
+        self.assertIn('misses=', timing)
+        self.assertTemplateUsed(response, 'posts/index.html')
+
+    def test_log_line_with_url_name(self):
+        with self.assertLogs('core.middleware', 'INFO') as logs:
+            self.client.get('/')
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record['view'], 'posts:index')
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['db_queries'], 0)
+        self.assertGreater(record['template_ms'], 0)
+
+    def test_nothing_recorded_outside_request(self):
+        self.assertIsNone(instrumentation.current())
+        with instrumentation.timer('template'):
+            Post.objects.count()
+        instrumentation.record_cache(1, 0, 0.1)
+        recorder = instrumentation.Recorder()
+        with recorder.timer('template'), recorder.timer('template'):
+            pass
+        self.assertEqual(recorder.counts['db'], 0)
+        self.assertIn('total;dur=', recorder.server_timing(0.01))
+
+
+# Метрики представлений: повторные запросы доходят до них.
+@override_settings(PAGE_CACHE_ENABLED=False)
+class MetricsTestClass(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'metrics.sqlite3')
+        self.settings = override_settings(
+            METRICS_PATH=self.path, METRICS_TOKEN='секрет'
+        )
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def test_endpoint(self):
+        self.client.get('/')
+        self.client.get('/')
+        response = self.client.get(
+            '/metrics', HTTP_AUTHORIZATION='Bearer секрет'
+        )
+        self.assertEqual(
+            response['Content-Type'],
+            'text/plain; version=0.0.4; charset=utf-8',
+        )
+        text = response.content.decode()
+        for line in (
+            '# TYPE yatube_request_duration_seconds histogram',
+            'yatube_requests_total{method="GET",status="200",'
+            'view="posts:index"} 2',
+            'yatube_request_duration_seconds_count{view="posts:index"} 2',
+            'yatube_db_queries_bucket{le="+Inf",view="posts:index"} 2',
+            'yatube_paginator_duration_seconds_count{view="posts:index"} 2',
+            'yatube_cache_hit_ratio{view="posts:index"}',
+        ):
+            self.assertIn(line, text)
+
+    def test_endpoint_requires_token(self):
+        for header in ({}, {'HTTP_AUTHORIZATION': 'Bearer чужой'}):
+            with self.subTest(header=header):
+                response = self.client.get('/metrics', **header)
+                self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        with override_settings(METRICS_TOKEN=''):
+            response = self.client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer '
+            )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_histogram_buckets(self):
+        store = metrics.Store(self.path)
+        store.observe('yatube_db_queries', {'view': 'v'}, 4)
+        samples = {
+            labels: value for name, labels, value in store.samples()
+            if name == 'yatube_db_queries_bucket'
+        }
+        self.assertEqual(samples['le="5",view="v"'], 1)
+        self.assertEqual(samples['le="+Inf",view="v"'], 1)
+        self.assertNotIn('le="3",view="v"', samples)
+
+    def test_aggregated_across_processes(self):
+        workers = [
+            multiprocessing.Process(target=_observe, args=(self.path, 25))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        text = metrics.render()
+        self.assertIn(
+            'yatube_db_queries_count{view="posts:index"} 100', text
+        )
+        self.assertIn('yatube_db_queries_sum{view="posts:index"} 300', text)
+
+
+class SlowQueryTestClass(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_tests_write_outside_project(self):
+        for path in (
+            settings.METRICS_PATH,
+            settings.SLOW_QUERY_LOG,
+            settings.PROFILING_DIR,
+        ):
+            with self.subTest(path=path):
+                self.assertFalse(path.startswith(settings.BASE_DIR))
+
+    def test_fingerprint_ignores_values(self):
+        self.assertEqual(
+            slow_queries.fingerprint(
+                "SELECT * FROM t WHERE a = 'x' AND id IN (%s, %s)"
+            ),
+            slow_queries.fingerprint(
+                "SELECT  * FROM t WHERE a = 'y''z' AND id IN (%s)"
+            ),
+        )
+        self.assertNotEqual(
+            slow_queries.fingerprint('SELECT * FROM t WHERE a = 1'),
+            slow_queries.fingerprint('SELECT * FROM t WHERE b = 1'),
+        )
+
+    @override_settings(SLOW_QUERY_MS=0)
+    def test_slow_queries_logged_with_plan(self):
+        with self.assertLogs('core.slow_queries', 'WARNING') as logs:
+            response = self.client.get('/')
+        entries = [json.loads(record.getMessage()) for record in logs.records]
+        listing = [
+            entry for entry in entries if 'post_date_idx' in (
+                entry['plan'] or ''
+            )
+        ]
+        self.assertTrue(listing)
+        self.assertEqual(listing[0]['view'], 'posts:index')
+        self.assertIn('posts/views.py', ' '.join(listing[0]['stack']))
+        # EXPLAIN не считается запросом страницы.
+        self.assertIn(
+            f'queries={len(entries)}', response['Server-Timing']
+        )
+
+    def test_fast_queries_not_logged(self):
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('core.slow_queries', 'WARNING'):
+                self.client.get('/')
+
+    def test_report_command(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'slow.jsonl')
+        with open(path, 'w') as file:
+            for number, duration in ((1, 150), (2, 250)):
+                file.write(json.dumps({
+                    'fingerprint': slow_queries.fingerprint(
+                        f'SELECT * FROM t WHERE id = {number}'
+                    ),
+                    'sql': f'SELECT * FROM t WHERE id = {number}',
+                    'duration_ms': duration,
+                    'view': 'posts:follow_index',
+                    'plan': 'SCAN t',
+                }) + '\n')
+            file.write('{"обрыв')
+        out = StringIO()
+        call_command('slow_queries', path=path, stdout=out)
+        self.assertIn('2 раз, всего 400.0 мс', out.getvalue())
+        self.assertIn('posts:follow_index ×2', out.getvalue())
+        self.assertIn('SELECT * FROM t WHERE id = ?', out.getvalue())
+        with self.assertRaises(CommandError):
+            call_command(
+                'slow_queries', path=path + '.missing', stdout=StringIO()
+            )
+
+
+class ProfilingTestClass(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.settings = override_settings(
+            PROFILING_DIR=directory.name, PROFILING_KEEP=2
+        )
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+        self.staff = User.objects.create_user('staff', is_staff=True)
+        self.user = User.objects.create_user('user')
+
+    def test_only_staff_is_profiled(self):
+        self.client.force_login(self.user)
+        response = self.client.get('/', {profiling.PARAM: 'cpu'})
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(profiling.captures(), [])
+        response = self.client.get(reverse('core:profiles'))
+        self.assertEqual(response.status_code, HTTPStatus.FOUND)
+
+    def test_capture_and_pages(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/', {profiling.PARAM: 'cpu'})
+        name = response['X-Profile-Id']
+        self.assertIn('posts_index', name)
+        response = self.client.get(reverse('core:profiles'))
+        self.assertContains(response, name)
+        response = self.client.get(
+            reverse('core:profile_detail', args=[name])
+        )
+        self.assertContains(response, 'posts/views.py')
+        self.assertIsNone(response.context['capture']['memory'])
+        response = self.client.get(
+            reverse('core:profile_detail', args=['missing'])
+        )
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_memory_mode_and_rotation(self):
+        self.client.force_login(self.staff)
+        names = [
+            self.client.get('/', HTTP_X_PROFILE='memory')['X-Profile-Id']
+            for _ in range(3)
+        ]
+        self.assertEqual(
+            [capture['name'] for capture in profiling.captures()],
+            names[:0:-1],
+        )
+        self.assertTrue(profiling.load(names[-1])['memory'])
+
+
+@override_settings(PAGE_CACHE_ENABLED=True)
+class PageCacheTestClass(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author')
+        self.reader = User.objects.create_user('reader')
+        self.post = Post.objects.create(author=self.author, text='Первый')
+
+    def test_anonymous_hit_skips_view(self):
+        first = self.client.get('/')
+        self.assertEqual(first['X-Page-Cache'], 'miss')
+        Post.objects.filter(pk=self.post.pk).update(text='Мимо сигналов')
+        second = self.client.get('/')
+        self.assertEqual(second['X-Page-Cache'], 'hit')
+        self.assertIsNone(second.context)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(
+            self.client.get('/', {'page': 2})['X-Page-Cache'], 'miss'
+        )
+
+    def test_conditional_get_on_hit(self):
+        etag = self.client.get('/')['ETag']
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def rename_author(self):
+        self.author.first_name, self.author.last_name = 'Новое', 'Имя'
+        self.author.save()
+
+    def test_writes_invalidate_pages(self):
+        detail = reverse('posts:post_detail', args=[self.post.pk])
+        profile = reverse('posts:profile', args=[self.author.username])
+        writes = (
+            ('/', lambda: Post.objects.create(
+                author=self.author, text='Второй'
+            ), 'Второй'),
+            (detail, lambda: Comment.objects.create(
+                post=self.post, author=self.reader, text='Отзыв'
+            ), 'Отзыв'),
+            (profile, lambda: Follow.objects.create(
+                user=self.reader, author=self.author
+            ), None),
+            ('/', self.rename_author, 'Новое Имя'),
+        )
+        for url, write, text in writes:
+            with self.subTest(url=url):
+                self.client.get(url)
+                self.assertEqual(self.client.get(url)['X-Page-Cache'], 'hit')
+                write()
+                response = self.client.get(url)
+                self.assertEqual(response['X-Page-Cache'], 'miss')
+                if text:
+                    self.assertContains(response, text)
+
+    def test_stale_page_while_rebuilding(self):
+        self.client.get('/')
+        Post.objects.create(author=self.author, text='Второй')
+
+        @contextmanager
+        def taken(key):
+            yield False
+
+        with mock.patch('core.page_cache.lock', taken):
+            response = self.client.get('/')
+        self.assertEqual(response['X-Page-Cache'], 'stale')
+        self.assertNotContains(response, 'Второй')
+        response = self.client.get('/')
+        self.assertEqual(response['X-Page-Cache'], 'miss')
+        self.assertContains(response, 'Второй')
+
+    def test_uncacheable_page_does_not_block(self):
+        """Гости не ждут друг друга на странице с CSRF-токеном"""
+        render = page_cache._render
+
+        def slow_render(*args):
+            time.sleep(0.3)
+            return render(*args)
+
+        def fetch_login():
+            responses.append(self.client_class().get('/auth/login/'))
+
+        responses = []
+        begin = time.monotonic()
+        with mock.patch('core.page_cache._render', slow_render):
+            workers = [threading.Thread(target=fetch_login) for _ in 'ab']
+            for worker in workers:
+                worker.start()
+                time.sleep(0.1)
+            for worker in workers:
+                worker.join()
+        self.assertLess(time.monotonic() - begin, 1.5)
+        self.assertEqual(len(responses), 2)
+        for response in responses:
+            self.assertEqual(response.status_code, HTTPStatus.OK)
+            self.assertNotIn('X-Page-Cache', response)
+
+    def test_deleted_post_not_served_stale(self):
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        self.client.get(url)
+        self.post.delete()
+        self.assertEqual(
+            self.client.get(url).status_code, HTTPStatus.NOT_FOUND
+        )
+
+        @contextmanager
+        def taken(key):
+            yield False
+
+        with mock.patch('core.page_cache.lock', taken):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_authenticated_not_cached(self):
+        self.client.force_login(self.reader)
+        self.client.get('/')
+        response = self.client.get('/')
+        self.assertNotIn('X-Page-Cache', response)
+        self.assertIsNotNone(response.context)
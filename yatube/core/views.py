@@ -1,6 +1,14 @@
+import hmac
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 from http import HTTPStatus
 
+from . import metrics as node_metrics
+from . import profiling
+
 
 def page_not_found(request, exception):
     return render(
@@ -24,3 +32,33 @@ def csrf_failure(request, reason=''):
 
 def permission_denied(request, exception):
     return render(request, 'core/403.html', status=HTTPStatus.FORBIDDEN)
+
+
+def metrics(request):
+    """ Метрики узла для Prometheus, только с токеном METRICS_TOKEN. """
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(
+        header.encode(), f'Bearer {token}'.encode()
+    ):
+        raise Http404
+    return HttpResponse(
+        node_metrics.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+@staff_member_required
+def profiles(request):
+    return render(request, 'core/profiles.html', {
+        'captures': profiling.captures(),
+        'param': profiling.PARAM,
+    })
+
+
+@staff_member_required
+def profile_detail(request, name):
+    capture = profiling.load(name)
+    if capture is None:
+        raise Http404
+    return render(request, 'core/profile_detail.html', {'capture': capture})
@@ -4,7 +4,11 @@ import sys
 
 
 def main():
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+    # Тесты идут на своих настройках: временные файлы кэша и метрик.
+    settings_module = 'yatube.settings'
+    if sys.argv[1:2] == ['test']:
+        settings_module = 'yatube.settings_test'
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc:
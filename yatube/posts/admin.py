@@ -17,6 +17,20 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_list_display(self, request):
+        # В списке — начало текста, полный текст не загружается.
+        return tuple(
+            'short_text' if name == 'text' else name
+            for name in self.list_display
+        )
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('text')
+
+    def short_text(self, post):
+        return post.excerpt + ('…' if post.has_more else '')
+    short_text.short_description = 'Текст поста'
+
 
 @admin.register(Group)
 class GroupAdmin(admin.ModelAdmin):
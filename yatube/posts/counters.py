@@ -0,0 +1,70 @@
+""" Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики меняются атомарным `UPDATE ... SET n = n + delta` из
+обработчиков сигналов моделей, в той же транзакции, что и запись.
+`rebuild` пересчитывает их с нуля.
+"""
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import AuthorCounter, Group, Post
+
+
+def _shift(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gt': 0})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def shift_user(user_id, field, delta):
+    counters = AuthorCounter.objects.filter(user_id=user_id)
+    if not _shift(counters, field, delta) and delta > 0:
+        AuthorCounter.objects.get_or_create(user_id=user_id)
+        _shift(counters, field, delta)
+
+
+def shift_group(group_id, delta):
+    if group_id is not None:
+        _shift(Group.objects.filter(pk=group_id), 'posts_count', delta)
+
+
+def shift_post(post_id, delta):
+    _shift(Post.objects.filter(pk=post_id), 'comments_count', delta)
+
+
+def _count(model, field):
+    """ Подзапрос числа строк `model` по внешнему ключу `field`. """
+    rows = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows), Value(0))
+
+
+def rebuild(apps=global_apps):
+    """ Пересчитывает все счётчики, принимает реестр моделей миграции. """
+    user_model = apps.get_model(settings.AUTH_USER_MODEL)
+    counter_model = apps.get_model('posts', 'AuthorCounter')
+    post_model = apps.get_model('posts', 'Post')
+    comment_model = apps.get_model('posts', 'Comment')
+    follow_model = apps.get_model('posts', 'Follow')
+    group_model = apps.get_model('posts', 'Group')
+
+    # Размер пачки выбирает бэкенд: SQLite ограничивает число строк
+    # в одном INSERT.
+    counter_model.objects.bulk_create(
+        counter_model(user_id=pk) for pk in user_model.objects.filter(
+            counters__isnull=True).values_list('pk', flat=True)
+    )
+    counter_model.objects.update(
+        posts_count=_count(post_model, 'author'),
+        followers_count=_count(follow_model, 'author'),
+        following_count=_count(follow_model, 'user'),
+    )
+    post_model.objects.update(comments_count=_count(comment_model, 'post'))
+    group_model.objects.update(posts_count=_count(post_model, 'group'))
@@ -1,5 +1,6 @@
 from django import forms
 
+from . import thumbnails
 from .models import Comment, Follow, Post
 
 
@@ -13,6 +14,12 @@ class PostForm(forms.ModelForm):
                       'text': 'Введите ссообщение',
                       'image': 'Выберите изображение'}
 
+    def save(self, commit=True):
+        post = super().save(commit=commit)
+        if commit and post.image and 'image' in self.changed_data:
+            thumbnails.schedule(post)
+        return post
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,80 @@
+""" Группы по слагу и пользователи по имени из кэша.
+
+Запись — `core.cache.Entry` с поколениями областей, от которых зависят
+поля объекта на страницах: число постов группы сдвигает `group:<pk>`,
+счётчики автора — `author:<pk>` и `feed:<pk>`. Правка, переименование
+и удаление сдвигают те же поколения (`posts.signals`), поэтому запись
+по старому слагу устаревает сама. Отсутствующий слаг тоже кэшируется
+на `IDENTITY_MISSING_TIMEOUT`, чтобы перебор несуществующих адресов не
+доходил до базы. Такая запись привязана к поколению `MISSING_SCOPE` своего
+вида: создание объекта (`forget`) сдвигает его, и копия записи в
+локальном кэше других процессов (`TieredCache`) устаревает сразу, ведь
+поколения читаются мимо него.
+"""
+import hashlib
+
+from core.cache import fetch, generations, invalidate, store
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Group, User
+
+KEY = 'identity:{}:{}'
+MISSING_SCOPE = 'identity-missing:{}'
+
+
+def _key(kind, value):
+    # Слаг и имя могут быть длинными, с пробелами и не ASCII.
+    return KEY.format(kind, hashlib.md5(value.encode()).hexdigest())
+
+
+def _lookup(kind, value, load, scopes):
+    key = _key(kind, value)
+    entry = fetch(key)
+    if entry is not None and not entry.stale():
+        instance = entry.value
+    else:
+        instance = load()
+        if instance is None:
+            scopes = [MISSING_SCOPE.format(kind)]
+            timeout = settings.IDENTITY_MISSING_TIMEOUT
+        else:
+            scopes = scopes(instance)
+            timeout = settings.IDENTITY_CACHE_TIMEOUT
+        store(
+            key, instance, timeout,
+            scopes=scopes, versions=generations(*scopes),
+        )
+    if instance is None:
+        raise Http404(f'Нет объекта {kind} «{value}»')
+    return instance
+
+
+def get_group(slug):
+    """ Группа по слагу или Http404. """
+    return _lookup(
+        'group', slug,
+        lambda: Group.objects.filter(slug=slug).first(),
+        lambda group: [f'group:{group.pk}'],
+    )
+
+
+def get_user(username):
+    """ Пользователь со счётчиками по имени или Http404.
+
+    Хэш пароля в кэш не попадает.
+    """
+    return _lookup(
+        'user', username,
+        lambda: User.objects.select_related('counters').defer(
+            'password'
+        ).filter(username=username).first(),
+        lambda user: [f'author:{user.pk}', f'feed:{user.pk}'],
+    )
+
+
+def forget(kind, value):
+    """ Удаляет запись и сбрасывает записи о том, что объекта нет. """
+    cache.delete(_key(kind, value))
+    invalidate(MISSING_SCOPE.format(kind))
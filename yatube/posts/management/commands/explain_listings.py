@@ -0,0 +1,187 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from posts import synthetic, timeline
+from posts.models import Comment, Follow, Group, Post, User
+from posts.utils import KeysetPaginator
+
+# Признак плана без подходящего индекса: сортировка во временном B-дереве.
+FULL_SORT = 'USE TEMP B-TREE'
+# Признак полного прохода таблицы или индекса: страница по курсору должна
+# начинаться поиском по ключу.
+FULL_SCAN = 'SCAN'
+PAGE = 11  # страница пагинатора и признак следующей
+# С какой страницы берётся курсор `after` для проверки глубоких страниц.
+DEEP_PAGE = 5
+
+
+def listing_queries(author, group, post, user):
+    """ Запросы страниц так, как их строят представления. """
+    by_date = ('-pub_date', '-pk')
+    return {
+        'index': Post.objects.for_listing().order_by(*by_date)[:PAGE],
+        'profile': author.posts.for_listing().order_by(*by_date)[:PAGE],
+        'group_posts': group.group.for_listing().order_by(*by_date)[:PAGE],
+        'post_detail comments': post.comments.for_listing().order_by(
+            'created', 'pk'
+        )[:PAGE],
+        'fan_out followers': Follow.objects.filter(
+            author=author
+        ).values_list('user_id', flat=True),
+        'follow check': Follow.objects.filter(user=user, author=author),
+        **sources('follow_index', KeysetPaginator(
+            timeline.feed(user), PAGE - 1, key=timeline.FEED_KEY
+        ).windows()),
+    }
+
+
+def sources(name, queries):
+    """ Запросы источников ленты под именами для отчёта. """
+    return {
+        name if index == 0 else f'{name} source {index}': queryset
+        for index, queryset in enumerate(queries)
+    }
+
+
+def after_cursor(queryset, key=('pub_date', 'pk'), descending=True):
+    """ Запросы следующей страницы по курсору `after` с глубокой страницы,
+    по одному на источник.
+
+    Курсор проходит кодирование и разбор, как из адреса страницы.
+    Пустой список, если список постов короче.
+    """
+    paginator = KeysetPaginator(queryset, PAGE - 1, key, descending)
+    paginator.get_page(DEEP_PAGE)
+    if paginator.next_cursor is None:
+        return []
+    _, values = paginator.decode_cursor(paginator.next_cursor)
+    return paginator.windows(values)
+
+
+def cursor_queries(author, group, post, user):
+    """ Запросы страниц по курсору `after` так, как их строят
+    представления.
+    """
+    return {
+        **sources('index after', after_cursor(Post.objects.for_listing())),
+        **sources('profile after', after_cursor(author.posts.for_listing())),
+        **sources(
+            'group_posts after', after_cursor(group.group.for_listing())
+        ),
+        **sources('post_detail comments after', after_cursor(
+            post.comments.for_listing(), ('created', 'pk'), descending=False
+        )),
+        **sources('follow_index after', after_cursor(
+            timeline.feed(user), timeline.FEED_KEY
+        )),
+    }
+
+
+class Command(BaseCommand):
+    help = ('Показывает планы (EXPLAIN QUERY PLAN) и время запросов '
+            'страниц постов; может заполнить базу синтетикой')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed', type=int, default=0, metavar='POSTS',
+            help='Сначала добавить столько постов; в непустую базу '
+                 'только вместе с --force',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Разрешить --seed, когда в базе уже есть данные',
+        )
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--random-seed', type=int, default=0)
+        parser.add_argument(
+            '--repeat', type=int, default=20,
+            help='Сколько раз выполнить запрос для замера',
+        )
+
+    def measure(self, queryset, repeat):
+        best = float('inf')
+        for _ in range(repeat):
+            begin = time.perf_counter()
+            list(queryset.all())
+            best = min(best, time.perf_counter() - begin)
+        return best
+
+    def report(self, name, queryset, repeat):
+        """ Печатает время и план запроса, отдаёт план. """
+        plan = queryset.explain()
+        elapsed = self.measure(queryset, repeat)
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{name}: {elapsed * 1000:.2f} мс'
+        ))
+        self.stdout.write(plan)
+        return plan
+
+    def seed(self, options):
+        if not options['force'] and (
+            User.objects.exists() or Post.objects.exists()
+        ):
+            raise CommandError(
+                'База не пуста: --seed допишет в неё синтетику и ленты. '
+                'Запустите на копии базы с --force'
+            )
+        try:
+            synthetic.generate(
+                options['users'], options['groups'], options['seed'],
+                comments=options['seed'] * 2,
+                follows=options['users'] * 20,
+                seed=options['random_seed'],
+                with_timeline=True,
+                log=self.stdout.write,
+            )
+        except ValueError as error:
+            raise CommandError(error)
+
+    def check_plans(self, objects, repeat):
+        """ Печатает планы, отдаёт описания найденных проблем. """
+        slow, scans = [], []
+        for name, queryset in listing_queries(*objects).items():
+            if FULL_SORT in self.report(name, queryset, repeat):
+                slow.append(name)
+        for name, queryset in cursor_queries(*objects).items():
+            plan = self.report(name, queryset, repeat)
+            if FULL_SORT in plan:
+                slow.append(name)
+            if FULL_SCAN in plan:
+                scans.append(name)
+        errors = []
+        if slow:
+            errors.append('Сортировка без индекса: ' + ', '.join(slow))
+        if scans:
+            errors.append('Проход без поиска по ключу: ' + ', '.join(scans))
+        return errors
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            self.seed(options)
+        if connection.vendor == 'sqlite':
+            # Статистика для планировщика, как после обслуживания базы.
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        post = Post.objects.order_by('-comments_count').first()
+        if post is None:
+            raise CommandError('В базе нет постов, запустите с --seed')
+        author = User.objects.order_by('-counters__posts_count').first()
+        group = Group.objects.order_by('-posts_count').first()
+        user = User.objects.order_by('-counters__following_count').first()
+        if group is None:
+            raise CommandError('В базе нет групп, запустите с --seed')
+
+        self.stdout.write(
+            f'Постов: {Post.objects.count()}, '
+            f'комментариев: {Comment.objects.count()}, '
+            f'подписок: {Follow.objects.count()}'
+        )
+        errors = self.check_plans(
+            (author, group, post, user), options['repeat']
+        )
+        if errors:
+            raise CommandError('; '.join(errors))
+        self.stdout.write(self.style.SUCCESS('Все запросы идут по индексам'))
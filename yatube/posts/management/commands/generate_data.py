@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import synthetic
+
+
+class Command(BaseCommand):
+    help = ('Генерирует пользователей, группы, посты, комментарии и '
+            'подписки для нагрузочного тестирования')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000)
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=300000)
+        parser.add_argument('--follows', type=int, default=200000)
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Одинаковый seed даёт одинаковые данные',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=5000,
+            help='Строк в одном bulk_create',
+        )
+        parser.add_argument(
+            '--days', type=int, default=365,
+            help='За сколько последних дней распределить посты',
+        )
+        parser.add_argument(
+            '--images', type=float, default=0, metavar='SHARE',
+            help='Доля постов с картинкой, от 0 до 1',
+        )
+        parser.add_argument(
+            '--image-variants', type=int, default=20,
+            help='Сколько разных картинок сгенерировать',
+        )
+        parser.add_argument(
+            '--timeline', action='store_true',
+            help='Заполнить ленты подписок (fan-out)',
+        )
+        parser.add_argument(
+            '--max-timeline-rows', type=int,
+            default=synthetic.MAX_TIMELINE_ROWS,
+            help='Не заполнять ленты, если записей может стать больше',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            synthetic.generate(
+                options['users'], options['groups'], options['posts'],
+                options['comments'], options['follows'],
+                seed=options['seed'],
+                chunk_size=options['chunk_size'],
+                days=options['days'],
+                images=options['images'],
+                image_variants=options['image_variants'],
+                with_timeline=options['timeline'],
+                max_timeline_rows=options['max_timeline_rows'],
+                log=self.stdout.write,
+            )
+        except ValueError as error:
+            raise CommandError(error)
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from posts import timeline
+from posts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'usernames', nargs='*',
+            help='Пользователи, чьи ленты пересобрать (по умолчанию все)',
+        )
+        parser.add_argument(
+            '--settle', action='store_true',
+            help='Не пересобирать, а переключить авторов между раздачей и '
+                 'чтением по запросу и срезать ленты до предела '
+                 '(запускайте периодически)',
+        )
+
+    def handle(self, *args, **options):
+        if options['settle']:
+            pulled, resumed = timeline.settle()
+            self.stdout.write(self.style.SUCCESS(
+                f'На чтение по запросу: {pulled}, снова в раздаче: {resumed}'
+            ))
+            return
+        users = None
+        if options['usernames']:
+            users = User.objects.filter(username__in=options['usernames'])
+        total = timeline.rebuild(users)
+        self.stdout.write(self.style.SUCCESS(
+            f'Лента пересобрана, записей: {total}'
+        ))
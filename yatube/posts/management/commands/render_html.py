@@ -0,0 +1,38 @@
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from posts import rendering
+
+
+class Command(BaseCommand):
+    help = ('Пересобирает сохранённый HTML постов и комментариев '
+            'старой версии пачками')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Сколько записей обновлять за раз',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Пересобрать все записи, а не только старой версии',
+        )
+
+    def handle(self, *args, **options):
+        begin = time.monotonic()
+        done = Counter()
+        for model, count in rendering.backfill(
+            chunk_size=options['chunk_size'], force=options['force']
+        ):
+            done[model] += count
+            self.stdout.write(f'{model}: {done[model]}')
+        elapsed = time.monotonic() - begin
+        summary = ', '.join(
+            f'{model} {count}' for model, count in done.items()
+        ) or 'всё уже актуально'
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово за {elapsed:.1f} с, версия HTML '
+            f'{rendering.VERSION}: {summary}'
+        ))
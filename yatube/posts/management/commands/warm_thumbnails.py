@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import time
+
+import django
+from core.cache import bump
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from posts import thumbnails
+from posts.models import Post
+
+# Последний обработанный пост: файл, а не кэш, чтобы вытеснение или
+# очистка кэша не начинали обход заново.
+CHECKPOINT_NAME = 'warm_thumbnails.checkpoint'
+
+
+def checkpoint_path():
+    return os.path.join(settings.RUNTIME_DIR, CHECKPOINT_NAME)
+
+
+def read_checkpoint():
+    try:
+        with open(checkpoint_path()) as checkpoint:
+            return int(checkpoint.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def write_checkpoint(pk):
+    path = checkpoint_path()
+    with open(f'{path}.tmp', 'w') as checkpoint:
+        checkpoint.write(str(pk))
+    os.replace(f'{path}.tmp', path)
+
+
+def clear_checkpoint():
+    try:
+        os.remove(checkpoint_path())
+    except FileNotFoundError:
+        pass
+
+
+def _init_worker(settings_module):
+    # При запуске через spawn дочерний процесс начинает с чистого
+    # интерпретатора, при fork вызов ничего не делает.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def _warm(image):
+    try:
+        thumbnails.generate(image)
+    except Exception as error:
+        return image, f'{type(error).__name__}: {error}'
+    finally:
+        connections.close_all()
+    return image, None
+
+
+class Command(BaseCommand):
+    help = ('Создаёт миниатюры всех картинок постов, чтобы новый узел '
+            'не генерировал их под нагрузкой')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Число процессов пула (1 - без пула)',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько постов читать из базы за раз',
+        )
+        parser.add_argument(
+            '--restart', action='store_true',
+            help='Начать с первого поста, а не с сохранённой позиции',
+        )
+        parser.add_argument(
+            '--after-pk', type=int, metavar='PK',
+            help='Начать после этого поста, а не с сохранённой позиции',
+        )
+
+    def posts(self, start):
+        return Post.objects.exclude(image='').filter(
+            pk__gt=start
+        ).order_by('pk')
+
+    def chunks(self, start, size):
+        while True:
+            chunk = list(self.posts(start).only(
+                'pk', 'image', 'author_id', 'group_id'
+            )[:size])
+            if not chunk:
+                return
+            yield chunk
+            start = chunk[-1].pk
+
+    def warm(self, chunk, pool):
+        """ Создаёт недостающие миниатюры постов пачки. """
+        todo = {}
+        for post in chunk:
+            if not all(thumbnails.cached(post.image.name, name)
+                       for name in thumbnails.GEOMETRIES):
+                todo.setdefault(post.image.name, []).append(post)
+        if pool is None:
+            results = map(_warm, todo)
+        else:
+            results = pool.imap_unordered(_warm, todo)
+        scopes = set()
+        generated = failed = 0
+        for image, error in results:
+            if error:
+                failed += 1
+                self.stderr.write(f'{image}: {error}')
+                continue
+            generated += 1
+            for post in todo[image]:
+                scopes.update(post.cache_scopes())
+        # Закэшированные списки с заглушками пересобираются с картинками.
+        bump(*scopes)
+        return generated, failed
+
+    def handle(self, *args, **options):
+        start = options['after_pk']
+        if start is None:
+            start = 0 if options['restart'] else read_checkpoint()
+        total = self.posts(start).count()
+        if start:
+            self.stdout.write(f'Продолжение после поста {start}')
+        processes = max(options['processes'], 1)
+        pool = None
+        if processes > 1:
+            # Соединения с базой не должны переходить в дочерние процессы.
+            connections.close_all()
+            pool = multiprocessing.Pool(
+                processes, _init_worker, (settings.SETTINGS_MODULE,)
+            )
+        begin = time.monotonic()
+        seen = generated = failed = 0
+        try:
+            for chunk in self.chunks(start, options['chunk_size']):
+                done, errors = self.warm(chunk, pool)
+                generated += done
+                failed += errors
+                seen += len(chunk)
+                write_checkpoint(chunk[-1].pk)
+                rate = generated / max(time.monotonic() - begin, 1e-6)
+                self.stdout.write(
+                    f'{seen}/{total} постов, создано {generated}, '
+                    f'ошибок {failed}, {rate:.1f} картинок/с'
+                )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        clear_checkpoint()
+        elapsed = time.monotonic() - begin
+        self.stdout.write(self.style.SUCCESS(
+            f'Готово: {seen} постов, создано миниатюр для {generated} '
+            f'картинок, ошибок {failed} за {elapsed:.1f} с'
+        ))
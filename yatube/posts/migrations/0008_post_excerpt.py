@@ -0,0 +1,38 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:40
+
+from django.db import migrations, models
+
+
+def fill_excerpts(apps, schema_editor):
+    from posts.models import make_excerpt
+    Post = apps.get_model('posts', 'Post')
+    posts = Post.objects.only('pk', 'text').order_by('pk').iterator()
+    chunk = []
+    for post in posts:
+        post.excerpt, post.has_more = make_excerpt(post.text)
+        chunk.append(post)
+        if len(chunk) == 1000:
+            Post.objects.bulk_update(chunk, ['excerpt', 'has_more'])
+            chunk = []
+    Post.objects.bulk_update(chunk, ['excerpt', 'has_more'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.CharField(blank=True, editable=False, max_length=300, verbose_name='Начало текста'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='has_more',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Текст длиннее начала'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
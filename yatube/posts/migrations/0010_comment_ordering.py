@@ -0,0 +1,17 @@
+# Generated by Django 2.2.16 on 2026-10-18 06:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_rendered_html'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='comment',
+            options={'ordering': ['created', 'id'], 'verbose_name': 'Коментарий', 'verbose_name_plural': 'Коментарии'},
+        ),
+    ]
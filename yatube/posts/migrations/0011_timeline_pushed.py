@@ -0,0 +1,24 @@
+# Generated by Django 2.2.16 on 2026-10-18 07:36
+
+from django.db import migrations, models
+
+
+def pull_expensive(apps, schema_editor):
+    from posts.timeline import pull_expensive
+    pull_expensive(apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_comment_ordering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorcounter',
+            name='timeline_pushed',
+            field=models.BooleanField(default=True, verbose_name='Посты раздаются в ленты'),
+        ),
+        migrations.RunPython(pull_expensive, migrations.RunPython.noop),
+    ]
@@ -1,8 +1,90 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
+
+from . import rendering
 
 User = get_user_model()
 
+EXCERPT_LENGTH = 300
+
+
+def make_excerpt(text, length=EXCERPT_LENGTH):
+    """Начало текста для списков и есть ли у него продолжение.
+
+    Текст длиннее length обрезается по последнему пробелу, если он не
+    слишком близко к началу.
+    """
+    if len(text) <= length:
+        return text, False
+    excerpt = text[:length]
+    space = max(excerpt.rfind(' '), excerpt.rfind('\n'))
+    if space > length // 2:
+        excerpt = excerpt[:space]
+    return excerpt.rstrip(), True
+
+
+class AtomicSaveModel(models.Model):
+    """Сохранение и обработчики post_save выполняются в одной транзакции."""
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class RenderedTextModel(AtomicSaveModel):
+    """Текст с HTML, собранным при записи (posts.rendering)."""
+    text_html = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='HTML текста',
+    )
+    html_version = models.PositiveSmallIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Версия HTML',
+    )
+
+    class Meta:
+        abstract = True
+
+    def derive_from_text(self):
+        """Заполняет поля, производные от text, отдаёт их имена."""
+        return rendering.apply(self)
+
+    def save(self, *args, **kwargs):
+        if 'text' not in self.get_deferred_fields():
+            derived = self.derive_from_text()
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None and 'text' in update_fields:
+                kwargs['update_fields'] = {*update_fields, *derived}
+        super().save(*args, **kwargs)
+
+    @property
+    def rendered_text(self):
+        return rendering.markup(self, 'text', 'text_html')
+
+
+class RenderedTextQuerySet(models.QuerySet):
+    """Поля, производные от text, заполняются и в обход save()."""
+
+    def update(self, **kwargs):
+        if isinstance(kwargs.get('text'), str):
+            instance = self.model(text=kwargs['text'])
+            kwargs.update(
+                (name, getattr(instance, name))
+                for name in instance.derive_from_text()
+            )
+        return super().update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for instance in objs:
+            instance.derive_from_text()
+        return super().bulk_create(objs, *args, **kwargs)
+
 
 class Group(models.Model):
     title = models.CharField(
@@ -20,6 +102,11 @@ class Group(models.Model):
         verbose_name='Описание',
         help_text='Тут будет описание группы'
     )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число постов',
+    )
 
     class Meta:
         verbose_name = 'Группы'
@@ -28,7 +115,24 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class PostQuerySet(RenderedTextQuerySet):
+    def for_listing(self):
+        """Пост с автором и группой одним запросом, без полного текста.
+
+        Спискам хватает начала текста (excerpt) и его HTML.
+        """
+        return self.select_related('author', 'group').defer(
+            'text', 'text_html'
+        )
+
+
+class CommentQuerySet(RenderedTextQuerySet):
+    def for_listing(self):
+        """Комментарий с автором одним запросом, текст — готовым HTML."""
+        return self.select_related('author').defer('text')
+
+
+class Post(RenderedTextModel):
     text = models.TextField(
         verbose_name='Текст поста',
         help_text='Введите текст поста'
@@ -41,6 +145,7 @@ class Post(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='posts',
+        db_index=False,
         verbose_name='Автор',
     )
     group = models.ForeignKey(
@@ -48,6 +153,7 @@ class Post(models.Model):
         blank=True,
         null=True,
         on_delete=models.SET_NULL,
+        db_index=False,
         verbose_name='Группа',
         help_text='Группа, к которой будет относиться пост',
         related_name='group'
@@ -57,21 +163,84 @@ class Post(models.Model):
         upload_to='posts/',
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Число комментариев',
+    )
+    excerpt = models.CharField(
+        max_length=EXCERPT_LENGTH,
+        blank=True,
+        editable=False,
+        verbose_name='Начало текста',
+    )
+    has_more = models.BooleanField(
+        default=False,
+        editable=False,
+        verbose_name='Текст длиннее начала',
+    )
+    excerpt_html = models.TextField(
+        blank=True,
+        editable=False,
+        verbose_name='HTML начала текста',
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ['-pub_date']
+        # Индексы под ключ пагинации (pub_date, pk) списков: главной,
+        # автора и группы. Они же заменяют индексы внешних ключей.
+        indexes = [
+            models.Index(
+                name='post_date_idx',
+                fields=['-pub_date', '-id'],
+            ),
+            models.Index(
+                name='post_author_date_idx',
+                fields=['author', '-pub_date', '-id'],
+            ),
+            models.Index(
+                name='post_group_date_idx',
+                fields=['group', '-pub_date', '-id'],
+            ),
+        ]
         verbose_name = 'Пост'
         verbose_name_plural = "Посты"
 
     def __str__(self):
-        return self.text[:15]
+        # В списках полный текст не загружен.
+        return (self.excerpt or self.text)[:15]
+
+    def derive_from_text(self):
+        self.excerpt, self.has_more = make_excerpt(self.text)
+        return ['excerpt', 'has_more', *super().derive_from_text()]
+
+    @property
+    def rendered_excerpt(self):
+        return rendering.markup(self, 'excerpt', 'excerpt_html')
+
+    def cache_scopes(self, previous=None):
+        """Области кэша (core.cache), которые затрагивает запись поста.
 
+        previous — прежние (author_id, group_id) отредактированного поста.
+        """
+        owners = {(self.author_id, self.group_id), previous or (None, None)}
+        scopes = ['posts', f'post:{self.pk}']
+        for author_id, group_id in owners:
+            if author_id is not None:
+                scopes.append(f'author:{author_id}')
+            if group_id is not None:
+                scopes.append(f'group:{group_id}')
+        return scopes
 
-class Comment(models.Model):
+
+class Comment(RenderedTextModel):
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
         related_name='comments',
+        db_index=False,
         verbose_name='Коментарий к посту'
     )
     author = models.ForeignKey(
@@ -86,7 +255,16 @@ class Comment(models.Model):
         auto_now_add=True,
     )
 
+    objects = CommentQuerySet.as_manager()
+
     class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(
+                name='comment_post_created_idx',
+                fields=['post', 'created', 'id'],
+            ),
+        ]
         verbose_name = 'Коментарий'
         verbose_name_plural = 'Коментарии'
 
@@ -94,7 +272,7 @@ class Comment(models.Model):
         return self.text
 
 
-class Follow(models.Model):
+class Follow(AtomicSaveModel):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -105,15 +283,98 @@ class Follow(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='following',
+        db_index=False,
         verbose_name='Пользователь',
     )
 
     class Meta:
+        # Уникальный индекс (user, author) обслуживает подписки читателя,
+        # (author, user) — раздачу поста подписчикам без чтения таблицы.
         constraints = [
             models.UniqueConstraint(
                 name="unique following",
                 fields=["user", "author"],
             ),
         ]
+        indexes = [
+            models.Index(
+                name='follow_author_user_idx',
+                fields=['author', 'user'],
+            ),
+        ]
         verbose_name = 'Подписка на автора'
         verbose_name_plural = 'Подписки на авторов'
+
+
+class TimelineEntry(models.Model):
+    """Материализованная лента подписок: пост в ленте подписчика."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пост',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                name='unique timeline entry',
+                fields=['user', 'post'],
+            ),
+        ]
+        indexes = [
+            models.Index(
+                name='timeline_feed_idx',
+                fields=['user', '-pub_date', '-post'],
+            ),
+            models.Index(
+                name='timeline_author_idx',
+                fields=['user', 'author'],
+            ),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи ленты'
+
+
+class AuthorCounter(models.Model):
+    """Счётчики пользователя, обновляемые при записи."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='counters',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число постов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Число подписок',
+    )
+    timeline_pushed = models.BooleanField(
+        default=True,
+        verbose_name='Посты раздаются в ленты',
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики пользователя'
+        verbose_name_plural = 'Счётчики пользователей'
@@ -0,0 +1,64 @@
+""" HTML текстов постов и комментариев, собранный при записи.
+
+`render` — то же, что фильтр `linebreaksbr` с экранированием. Результат
+хранится рядом с исходным текстом вместе с номером версии `VERSION`;
+шаблоны выводят его как есть (`rendered_text`, `rendered_excerpt`), а
+запись старой версии показывают, собрав HTML на лету. После изменения
+`render` нужно увеличить `VERSION` и пересобрать записи командой
+`render_html`.
+"""
+from django.apps import apps as global_apps
+from django.template.defaultfilters import linebreaksbr
+from django.utils.safestring import mark_safe
+
+VERSION = 1
+# Модель -> пары (поле текста, поле его HTML).
+TARGETS = {
+    'Post': (('text', 'text_html'), ('excerpt', 'excerpt_html')),
+    'Comment': (('text', 'text_html'),),
+}
+
+
+def render(text):
+    return linebreaksbr(text, autoescape=True)
+
+
+def apply(instance):
+    """ Собирает HTML записи, отдаёт имена изменённых полей. """
+    fields = ['html_version']
+    for source, target in TARGETS[type(instance).__name__]:
+        setattr(instance, target, render(getattr(instance, source)))
+        fields.append(target)
+    instance.html_version = VERSION
+    return fields
+
+
+def markup(instance, source, target):
+    """ Сохранённый HTML или, для старой версии, собранный сейчас. """
+    if instance.html_version == VERSION:
+        return mark_safe(getattr(instance, target))
+    return render(getattr(instance, source))
+
+
+def backfill(apps=global_apps, chunk_size=1000, force=False):
+    """ Пересобирает HTML пачками, принимает реестр моделей миграции.
+
+    Отдаёт (модель, число записей) после каждой пачки.
+    """
+    for name, pairs in TARGETS.items():
+        model = apps.get_model('posts', name)
+        rows = model.objects.order_by('pk')
+        if not force:
+            rows = rows.exclude(html_version=VERSION)
+        sources = [source for source, _ in pairs]
+        start = 0
+        while True:
+            chunk = list(rows.filter(pk__gt=start).only('pk', *sources)[
+                :chunk_size
+            ])
+            if not chunk:
+                break
+            fields = [apply(instance) for instance in chunk][0]
+            model.objects.bulk_update(chunk, fields)
+            start = chunk[-1].pk
+            yield name, len(chunk)
@@ -0,0 +1,102 @@
+from core.cache import invalidate
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import counters, identity, timeline
+from .models import AuthorCounter, Comment, Follow, Group, Post
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def create_counters(sender, instance, created, **kwargs):
+    if created:
+        AuthorCounter.objects.get_or_create(user=instance)
+
+
+def _renamed(created):
+    # Имена авторов и слаги групп выводятся в списках любых страниц
+    # (область `names`); новый объект там ещё не встречается.
+    return () if created else ('names',)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created=False, update_fields=None,
+               **kwargs):
+    # Вход обновляет только last_login, на страницах его нет.
+    if update_fields == frozenset({'last_login'}):
+        return
+    identity.forget('user', instance.username)
+    invalidate(f'author:{instance.pk}', *_renamed(created))
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_saved(sender, instance, created=False, **kwargs):
+    identity.forget('group', instance.slug)
+    invalidate(f'group:{instance.pk}', *_renamed(created))
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_owner(sender, instance, **kwargs):
+    instance._previous = None
+    if instance.pk is not None:
+        instance._previous = Post.objects.filter(pk=instance.pk).values_list(
+            'author_id', 'group_id'
+        ).first()
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    invalidate(*instance.cache_scopes(instance._previous))
+    if created:
+        counters.shift_user(instance.author_id, 'posts_count', 1)
+        counters.shift_group(instance.group_id, 1)
+        timeline.fan_out(instance)
+        return
+    if instance._previous is None:
+        return
+    author_id, group_id = instance._previous
+    if author_id != instance.author_id:
+        counters.shift_user(author_id, 'posts_count', -1)
+        counters.shift_user(instance.author_id, 'posts_count', 1)
+    if group_id != instance.group_id:
+        counters.shift_group(group_id, -1)
+        counters.shift_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    invalidate(*instance.cache_scopes())
+    counters.shift_user(instance.author_id, 'posts_count', -1)
+    counters.shift_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    invalidate(f'post:{instance.post_id}')
+    if created:
+        counters.shift_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    invalidate(f'post:{instance.post_id}')
+    counters.shift_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, **kwargs):
+    invalidate(f'feed:{instance.user_id}', f'author:{instance.author_id}')
+    if created:
+        counters.shift_user(instance.user_id, 'following_count', 1)
+        counters.shift_user(instance.author_id, 'followers_count', 1)
+        timeline.follow(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    invalidate(f'feed:{instance.user_id}', f'author:{instance.author_id}')
+    counters.shift_user(instance.user_id, 'following_count', -1)
+    counters.shift_user(instance.author_id, 'followers_count', -1)
+    timeline.unfollow(instance.user_id, instance.author_id)
@@ -0,0 +1,365 @@
+""" Синтетические данные для нагрузочного тестирования.
+
+Распределения близки к настоящим соцсетям: число постов автора и число
+подписчиков подчиняются степенному закону (закон Ципфа), так что
+немногие популярные авторы пишут и читаются больше всех остальных.
+Одинаковый `seed` даёт одинаковые данные. Строки вставляются
+`bulk_create` пачками без сигналов, счётчики и ленты строятся в конце
+одним проходом. Каждая пачка — своя транзакция, а между этапами журнал
+WAL переносится в базу (`checkpoint`): иначе одна транзакция на всю
+генерацию держит блокировку записи и растит журнал до размера данных.
+Прерванный прогон оставляет уже вставленные строки, повтор — с другим
+`seed`.
+"""
+import heapq
+import io
+import random
+import time
+from datetime import datetime, timezone
+from itertools import accumulate, groupby, islice
+from operator import itemgetter
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+
+from . import counters, timeline
+from .models import Comment, Follow, Group, Post, TimelineEntry, User
+
+WORDS = (
+    'лето море город утро книга дорога друг кофе музыка дождь вечер '
+    'работа код проект идея кошка парк ветер снег солнце поезд улица '
+    'история фильм звезда окно чай сад река мост день ночь мысль'
+).split()
+# Показатели степенного закона: чем больше, тем сильнее перекос.
+POSTS_ALPHA = 1.1
+FOLLOWERS_ALPHA = 1.0
+COMMENTS_ALPHA = 0.8
+GROUP_ALPHA = 1.0
+GROUP_SHARE = 0.7
+COMMENT_DELAY = 3 * 60 * 60  # среднее время до комментария, с
+# Сколько записей лент можно заполнить без явного разрешения.
+MAX_TIMELINE_ROWS = 5 * 1000 * 1000
+
+
+def zipf_weights(count, alpha):
+    """ Накопленные веса рангов 1..count для `random.choices`. """
+    return list(accumulate(1 / rank ** alpha for rank in range(1, count + 1)))
+
+
+def _chunks(objects, size):
+    objects = iter(objects)
+    chunk = list(islice(objects, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(objects, size))
+
+
+def _images(rng, count, prefix):
+    from PIL import Image, ImageDraw
+
+    names = []
+    for number in range(count):
+        image = Image.new('RGB', (1200, 800), tuple(
+            rng.randrange(256) for _ in range(3)
+        ))
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x, y = rng.randrange(1200), rng.randrange(800)
+            draw.ellipse(
+                (x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 400)),
+                fill=tuple(rng.randrange(256) for _ in range(3)),
+            )
+        content = io.BytesIO()
+        image.save(content, 'JPEG', quality=80)
+        names.append(default_storage.save(
+            f'posts/{prefix}{number}.jpg', ContentFile(content.getvalue())
+        ))
+    return names
+
+
+class Generator:
+    def __init__(self, seed=0, chunk_size=5000, days=365, log=None):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.prefix = f'gen{seed}_'
+        self.chunk_size = chunk_size
+        self.days = days
+        self.log = log or (lambda message: None)
+
+    def insert(self, model, objects, dated=None, **kwargs):
+        """ Вставляет пачками, возвращает число строк.
+
+        `dated` — имя поля auto_now_add и запрос своих строк модели:
+        даты поля берутся из объектов (`bulk_create_dated`).
+        """
+        begin, total = time.monotonic(), 0
+        for chunk in _chunks(objects, self.chunk_size):
+            with transaction.atomic():
+                if dated is None:
+                    model.objects.bulk_create(chunk, **kwargs)
+                else:
+                    self.bulk_create_dated(model, chunk, *dated)
+            total += len(chunk)
+        elapsed = max(time.monotonic() - begin, 1e-6)
+        self.log(
+            f'{model.__name__}: {total} '
+            f'за {elapsed:.1f} с ({total / elapsed:.0f} строк/с)'
+        )
+        return total
+
+    def bulk_create_dated(self, model, chunk, field_name, ours):
+        """ Вставляет пачку с датами объектов в поле auto_now_add.
+
+        `bulk_create` заменяет такие даты текущим временем, поэтому они
+        переписываются по новым pk в той же транзакции. Снимать
+        auto_now_add с поля нельзя: оно общее для всех потоков.
+        """
+        field = model._meta.get_field(field_name)
+        dates = [
+            field.get_db_prep_value(getattr(obj, field.attname), connection)
+            for obj in chunk
+        ]
+        after = self.last_id(model)
+        model.objects.bulk_create(chunk)
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'UPDATE {quote(model._meta.db_table)} '
+                f'SET {quote(field.column)} = %s '
+                f'WHERE {quote(model._meta.pk.column)} = %s',
+                list(zip(dates, self.new_ids(ours, after))),
+            )
+
+    def checkpoint(self):
+        """ Переносит журнал WAL в файл базы и обрезает его. """
+        if connection.vendor == 'sqlite' and not connection.in_atomic_block:
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def new_ids(self, queryset, after):
+        return list(queryset.filter(pk__gt=after).order_by('pk').values_list(
+            'pk', flat=True
+        ))
+
+    def last_id(self, model):
+        return model.objects.order_by('-pk').values_list(
+            'pk', flat=True
+        ).first() or 0
+
+    def text(self, low, high):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    def users(self, count):
+        after = self.last_id(User)
+        self.insert(User, (
+            # Пароль '!' — неиспользуемый, без дорогого хеширования.
+            User(username=f'{self.prefix}{number}', password='!')
+            for number in range(count)
+        ))
+        return self.new_ids(
+            User.objects.filter(username__startswith=self.prefix), after
+        )
+
+    def groups(self, count):
+        after = self.last_id(Group)
+        self.insert(Group, (
+            Group(
+                title=f'Группа {number}',
+                slug=f'{self.prefix}group{number}',
+                description=self.text(5, 30),
+            )
+            for number in range(count)
+        ))
+        return self.new_ids(
+            Group.objects.filter(slug__startswith=self.prefix), after
+        )
+
+    def timestamps(self, count):
+        """ Возрастающие моменты публикаций за последние `days` дней. """
+        now = time.time()
+        moment = now - self.days * 24 * 60 * 60
+        rate = count / (now - moment)
+        for _ in range(count):
+            moment += self.rng.expovariate(rate)
+            yield min(moment, now)
+
+    def choices(self, population, weights, count):
+        """ Поток выборок с весами, пачками для скорости. """
+        while count > 0:
+            size = min(count, self.chunk_size)
+            yield from self.rng.choices(population, cum_weights=weights,
+                                        k=size)
+            count -= size
+
+    def posts(self, count, authors, groups, images, image_share):
+        after = self.last_id(Post)
+        group_weights = zipf_weights(len(groups), GROUP_ALPHA)
+        author_ids = self.choices(
+            authors, zipf_weights(len(authors), POSTS_ALPHA), count
+        )
+        dates, owners = [], []
+
+        def rows():
+            for author_id, moment in zip(author_ids, self.timestamps(count)):
+                dates.append(moment)
+                owners.append(author_id)
+                group_id = None
+                if groups and self.rng.random() < GROUP_SHARE:
+                    group_id = self.rng.choices(
+                        groups, cum_weights=group_weights
+                    )[0]
+                yield Post(
+                    author_id=author_id,
+                    group_id=group_id,
+                    text=self.text(5, 80),
+                    pub_date=datetime.fromtimestamp(moment, timezone.utc),
+                    image=(
+                        self.rng.choice(images)
+                        if images and self.rng.random() < image_share
+                        else ''
+                    ),
+                )
+
+        # Пачки фиксируются по одной, между ними пишет и сайт.
+        ours = Post.objects.filter(author__username__startswith=self.prefix)
+        self.insert(Post, rows(), dated=('pub_date', ours))
+        return list(zip(self.new_ids(ours, after), dates, owners))
+
+    def comments(self, count, posts, users):
+        if not posts:
+            return
+        ranked = list(posts)
+        self.rng.shuffle(ranked)
+        picks = self.choices(
+            ranked, zipf_weights(len(ranked), COMMENTS_ALPHA), count
+        )
+        now = time.time()
+
+        def rows():
+            for post_id, moment, _ in picks:
+                moment = min(
+                    moment + self.rng.expovariate(1 / COMMENT_DELAY), now
+                )
+                yield Comment(
+                    post_id=post_id,
+                    author_id=self.rng.choice(users),
+                    text=self.text(2, 30),
+                    created=datetime.fromtimestamp(moment, timezone.utc),
+                )
+
+        ours = Comment.objects.filter(
+            author__username__startswith=self.prefix
+        )
+        self.insert(Comment, rows(), dated=('created', ours))
+
+    def follows(self, count, users, popular):
+        authors = self.choices(
+            popular, zipf_weights(len(popular), FOLLOWERS_ALPHA), count
+        )
+        self.insert(Follow, (
+            Follow(user_id=user_id, author_id=author_id)
+            for user_id, author_id in zip(
+                self.choices(users, None, count), authors
+            )
+            if user_id != author_id
+        ), ignore_conflicts=True)
+
+    def timeline(self, posts):
+        """ Ленты подписок, как их построила бы раздача при записи: без
+        авторов дороже порога и не длиннее предела ленты.
+        """
+        limit = timeline.max_entries()
+        by_author = {}
+        for post_id, moment, author_id in posts:
+            by_author.setdefault(author_id, []).append((moment, post_id))
+        for author_posts in by_author.values():
+            author_posts.sort(reverse=True)
+            del author_posts[limit:]
+        timeline.pull_expensive()
+        follows = Follow.objects.filter(
+            author__username__startswith=self.prefix,
+            author__counters__timeline_pushed=True,
+        ).values_list('user_id', 'author_id').order_by('user_id')
+        feeds = [
+            (user_id, [author_id for _, author_id in rows])
+            for user_id, rows in groupby(
+                follows.iterator(chunk_size=self.chunk_size),
+                key=itemgetter(0),
+            )
+        ]
+        expected = sum(
+            min(limit, sum(len(by_author.get(a, ())) for a in authors))
+            for _, authors in feeds
+        )
+        self.log(f'Записей в лентах: {expected}')
+
+        def rows():
+            for user_id, authors in feeds:
+                latest = heapq.merge(*(
+                    [(moment, post_id, author_id)
+                     for moment, post_id in by_author.get(author_id, ())]
+                    for author_id in authors
+                ), reverse=True)
+                for moment, post_id, author_id in islice(latest, limit):
+                    yield TimelineEntry(
+                        user_id=user_id,
+                        post_id=post_id,
+                        author_id=author_id,
+                        pub_date=datetime.fromtimestamp(
+                            moment, timezone.utc
+                        ),
+                    )
+
+        self.insert(TimelineEntry, rows(), ignore_conflicts=True)
+
+    def run(self, users, groups, posts, comments, follows, images=0,
+            image_variants=20, with_timeline=False,
+            max_timeline_rows=MAX_TIMELINE_ROWS):
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise ValueError(
+                f'Данные с seed {self.seed} уже есть, выберите другой'
+            )
+        # Лента каждого пользователя не длиннее предела: оценка сверху
+        # известна до генерации.
+        bound = users * timeline.max_entries()
+        if with_timeline and bound > max_timeline_rows:
+            raise ValueError(
+                f'Ленты займут до {bound} записей, больше '
+                f'{max_timeline_rows}: уменьшите число пользователей '
+                f'или поднимите предел'
+            )
+        begin = time.monotonic()
+        user_ids = self.users(users)
+        group_ids = self.groups(groups)
+        self.checkpoint()
+        # Популярность пользователя: ранг в случайной перестановке.
+        # Одни и те же авторы и пишут, и читаются больше других.
+        popular = list(user_ids)
+        self.rng.shuffle(popular)
+        image_names = []
+        if images:
+            image_names = _images(self.rng, image_variants, self.prefix)
+        post_rows = self.posts(posts, popular, group_ids, image_names, images)
+        self.checkpoint()
+        self.comments(comments, post_rows, user_ids)
+        self.checkpoint()
+        self.follows(follows, user_ids, popular)
+        with transaction.atomic():
+            counters.rebuild()
+        self.checkpoint()
+        if with_timeline:
+            self.timeline(post_rows)
+            self.checkpoint()
+        self.log(f'Готово за {time.monotonic() - begin:.1f} с')
+
+
+def generate(users, groups, posts, comments, follows, seed=0,
+             chunk_size=5000, days=365, images=0, image_variants=20,
+             with_timeline=False, max_timeline_rows=MAX_TIMELINE_ROWS,
+             log=None):
+    """ Генерирует данные, параметры как у команды generate_data. """
+    Generator(seed, chunk_size, days, log).run(
+        users, groups, posts, comments, follows,
+        images, image_variants, with_timeline, max_timeline_rows,
+    )
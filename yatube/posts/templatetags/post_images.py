@@ -0,0 +1,13 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.inclusion_tag('includes/post_image.html')
+def post_image(post, name='post'):
+    return {
+        'post': post,
+        'thumbnail': thumbnails.ready(post, name),
+    }
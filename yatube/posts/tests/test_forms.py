@@ -1,16 +1,31 @@
 import shutil
 import tempfile
+from io import StringIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
+from posts import thumbnails
 from posts.forms import PostForm
+from posts.management.commands import warm_thumbnails
 
 from ..models import Group, Post, User
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 User = get_user_model()
 
@@ -148,3 +163,118 @@ class PostFormTest(TestCase):
             data=form_data,
             follow=True)
         self.assertNotContains(response, form_data['text'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def create_post(self, text):
+        uploaded = SimpleUploadedFile(
+            name=f'{text}.gif', content=SMALL_GIF, content_type='image/gif'
+        )
+        self.client.post(
+            reverse('posts:post_create'),
+            data={'text': text, 'image': uploaded},
+        )
+        post = Post.objects.get(text=text)
+        self.assertTrue(post.image)
+        return reverse('posts:post_detail', kwargs={'post_id': post.pk})
+
+    @override_settings(THUMBNAIL_ASYNC=True)
+    def test_placeholder_until_thumbnail_ready(self):
+        """Пока миниатюры нет, выводится заглушка, затем картинка"""
+        url = self.create_post('async')
+        response = self.client.get(url)
+        self.assertContains(response, 'aspect-ratio')
+        self.assertNotContains(response, '<img class="card-img')
+        thumbnails.generate(Post.objects.get(text='async').image.name)
+        response = self.client.get(url)
+        self.assertContains(response, '<img class="card-img')
+        self.assertNotContains(response, 'aspect-ratio')
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_thumbnail_created_on_save(self):
+        """Без пула миниатюра создаётся при сохранении поста"""
+        response = self.client.get(self.create_post('sync'))
+        self.assertContains(response, '<img class="card-img')
+
+    @override_settings(THUMBNAIL_ASYNC=False)
+    def test_missing_image_not_requeued(self):
+        """Картинка без файла не ставится в очередь при каждом показе"""
+        post = Post.objects.create(
+            author=self.user, text='missing', image='posts/missing.gif'
+        )
+        with mock.patch.object(
+            thumbnails, 'generate', wraps=thumbnails.generate
+        ) as generate, self.assertLogs('posts.thumbnails', 'WARNING'):
+            self.assertIsNone(thumbnails.ready(post))
+            self.assertIsNone(thumbnails.ready(post))
+        self.assertEqual(generate.call_count, 1)
+
+    def test_warm_command(self):
+        """Команда создаёт недостающие миниатюры и продолжает с позиции"""
+        for text in ('first', 'second'):
+            Post.objects.create(
+                author=self.user, text=text,
+                image=SimpleUploadedFile(f'{text}.gif', SMALL_GIF),
+            )
+        first, second = Post.objects.order_by('pk')
+        warm_thumbnails.write_checkpoint(first.pk)
+        cache.clear()
+        call_command('warm_thumbnails', processes=1, stdout=StringIO())
+        self.assertIsNone(thumbnails.cached(first.image.name))
+        self.assertIsNotNone(thumbnails.cached(second.image.name))
+        self.assertEqual(warm_thumbnails.read_checkpoint(), 0)
+
+        out = StringIO()
+        call_command('warm_thumbnails', processes=1, stdout=out)
+        self.assertIsNotNone(thumbnails.cached(first.image.name))
+        self.assertIn('создано миниатюр для 1 картинок', out.getvalue())
+
+        out = StringIO()
+        call_command(
+            'warm_thumbnails', processes=1, after_pk=first.pk, stdout=out
+        )
+        self.assertIn('Продолжение после поста', out.getvalue())
+        self.assertIn('Готово: 1 постов', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_ASYNC=True)
+class ThumbnailPoolTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='auth')
+        self.client.force_login(self.user)
+        # Пул останавливается раньше, чем удаляется MEDIA_ROOT.
+        self.addCleanup(shutil.rmtree, TEMP_MEDIA_ROOT, True)
+        self.addCleanup(thumbnails.shutdown)
+
+    def test_pool_creates_thumbnail(self):
+        """После фиксации поста пул создаёт файл миниатюры"""
+        self.client.post(
+            reverse('posts:post_create'),
+            data={
+                'text': 'pool',
+                'image': SimpleUploadedFile(
+                    'pool.gif', SMALL_GIF, content_type='image/gif'
+                ),
+            },
+        )
+        image = Post.objects.get(text='pool').image.name
+        thumbnails.shutdown()
+        thumbnail = thumbnails.cached(image)
+        self.assertIsNotNone(thumbnail)
+        self.assertTrue(thumbnail.exists())
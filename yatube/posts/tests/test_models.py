@@ -1,7 +1,17 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db.models import F, Max, Min
+from django.contrib.admin.sites import site
+from django.test import RequestFactory, TestCase, TransactionTestCase
 
-from ..models import Group, Post, User
+from .. import rendering, synthetic, timeline
+from ..management.commands.explain_listings import cursor_queries
+from ..models import (EXCERPT_LENGTH, AuthorCounter, Comment, Follow, Group,
+                      Post, TimelineEntry, User)
 
 User = get_user_model()
 
@@ -60,3 +70,325 @@ class PostModelTest(TestCase):
             with self.subTest(value=value):
                 self.assertEqual(
                     task._meta.get_field(value).verbose_name, expected)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая группа',
+            slug='other-slug',
+            description='Тестовое описание',
+        )
+
+    def assertCounters(self, **expected):
+        counters = {
+            'posts': AuthorCounter.objects.get(user=self.author).posts_count,
+            'followers': AuthorCounter.objects.get(
+                user=self.author).followers_count,
+            'following': AuthorCounter.objects.get(
+                user=self.reader).following_count,
+            'group': Group.objects.get(pk=self.group.pk).posts_count,
+            'other_group': Group.objects.get(
+                pk=self.other_group.pk).posts_count,
+        }
+        self.assertEqual(counters, expected)
+
+    def test_counters_follow_writes(self):
+        """Счётчики меняются вместе с постами, комментариями и подписками"""
+        post = Post.objects.create(
+            author=self.author, text='Пост', group=self.group
+        )
+        Post.objects.create(author=self.author, text='Пост без группы')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Comment.objects.create(post=post, author=self.reader, text='Ком')
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 1)
+        self.assertCounters(
+            posts=2, followers=1, following=1, group=1, other_group=0
+        )
+        post.group = self.other_group
+        post.save()
+        self.assertCounters(
+            posts=2, followers=1, following=1, group=0, other_group=1
+        )
+        post.delete()
+        Follow.objects.all().delete()
+        self.assertCounters(
+            posts=1, followers=0, following=0, group=0, other_group=0
+        )
+
+    def test_rebuild_command(self):
+        """Команда пересчитывает счётчики с нуля"""
+        Post.objects.bulk_create(
+            Post(author=self.author, text='Пост', group=self.group)
+            for _ in range(3)
+        )
+        Follow.objects.create(user=self.reader, author=self.author)
+        AuthorCounter.objects.update(followers_count=7)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertCounters(
+            posts=3, followers=1, following=1, group=3, other_group=0
+        )
+
+
+class ExcerptTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.long_text = 'слово ' * 100
+
+    def test_excerpt_kept_up_to_date(self):
+        """Начало текста обновляется при сохранении, update и bulk_create"""
+        post = Post.objects.create(author=self.user, text='Короткий')
+        self.assertEqual((post.excerpt, post.has_more), ('Короткий', False))
+        post.text = self.long_text
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertTrue(post.has_more)
+        self.assertLessEqual(len(post.excerpt), EXCERPT_LENGTH)
+        self.assertTrue(self.long_text.startswith(post.excerpt))
+        self.assertFalse(post.excerpt.endswith(' '))
+        Post.objects.filter(pk=post.pk).update(text='Снова короткий')
+        post.refresh_from_db()
+        self.assertEqual(
+            (post.excerpt, post.has_more), ('Снова короткий', False)
+        )
+        Post.objects.bulk_create([Post(author=self.user, text='Пакетом')])
+        self.assertTrue(Post.objects.filter(excerpt='Пакетом').exists())
+
+    def test_listing_defers_text(self):
+        """Списки не читают полный текст"""
+        Post.objects.create(author=self.user, text=self.long_text)
+        with self.assertNumQueries(1) as context:
+            post = Post.objects.for_listing().get()
+            self.assertEqual(str(post), self.long_text[:15])
+        self.assertNotIn('"text"', context.captured_queries[0]['sql'])
+        response = self.client.get('/')
+        self.assertContains(response, f'{post.excerpt}…')
+        self.assertNotContains(response, self.long_text)
+
+    def test_admin_list_shows_excerpt(self):
+        """Админка показывает в списке начало текста"""
+        admin = site._registry[Post]
+        self.assertIn('text', admin.list_display)
+        request = RequestFactory().get('/admin/posts/post/')
+        self.assertIn('short_text', admin.get_list_display(request))
+        self.assertNotIn('text', admin.get_list_display(request))
+
+
+class RenderedHtmlTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.text = '<b>Первая</b>\nвторая'
+        cls.html = '&lt;b&gt;Первая&lt;/b&gt;<br>вторая'
+
+    def test_html_stored_on_write(self):
+        """HTML текста собирается при записи и выводится как есть"""
+        post = Post.objects.create(author=self.user, text=self.text)
+        comment = Comment.objects.create(
+            post=post, author=self.user, text=self.text
+        )
+        for instance in (post, comment):
+            with self.subTest(model=type(instance).__name__):
+                instance.refresh_from_db()
+                self.assertEqual(instance.text_html, self.html)
+                self.assertEqual(instance.html_version, rendering.VERSION)
+        self.assertEqual(post.excerpt_html, self.html)
+        response = self.client.get(f'/posts/{post.pk}/')
+        self.assertContains(response, self.html, count=2)
+
+    def test_old_version_rendered_and_backfilled(self):
+        """Старая версия собирается на лету и пересобирается командой"""
+        post = Post.objects.create(author=self.user, text=self.text)
+        Comment.objects.create(post=post, author=self.user, text=self.text)
+        Post.objects.update(html_version=0, excerpt_html='')
+        Comment.objects.update(html_version=0, text_html='')
+        post = Post.objects.for_listing().get()
+        self.assertEqual(post.rendered_excerpt, self.html)
+        out = StringIO()
+        call_command('render_html', chunk_size=1, stdout=out)
+        self.assertIn('Post 1, Comment 1', out.getvalue())
+        for model in (Post, Comment):
+            with self.subTest(model=model.__name__):
+                self.assertFalse(
+                    model.objects.exclude(
+                        html_version=rendering.VERSION
+                    ).exists()
+                )
+        self.assertEqual(Comment.objects.get().text_html, self.html)
+
+
+class ListingIndexTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command(
+            'explain_listings', seed=300, users=20, groups=3, repeat=1,
+            stdout=StringIO(),
+        )
+
+    def test_listing_queries_use_indexes(self):
+        """Страницы постов читаются по составным индексам без сортировки"""
+        author = User.objects.order_by('-counters__posts_count').first()
+        group = Group.objects.order_by('-posts_count').first()
+        post = Post.objects.order_by('-comments_count').first()
+        by_date = ('-pub_date', '-pk')
+        plans = {
+            'post_date_idx': Post.objects.order_by(*by_date)[:11],
+            'post_author_date_idx': author.posts.order_by(*by_date)[:11],
+            'post_group_date_idx': group.group.order_by(*by_date)[:11],
+            'comment_post_created_idx': post.comments.order_by(
+                'created', 'pk'
+            )[:11],
+            'follow_author_user_idx': Follow.objects.filter(
+                author=author
+            ).values_list('user_id', flat=True),
+        }
+        for index, queryset in plans.items():
+            with self.subTest(index=index):
+                plan = queryset.explain()
+                self.assertIn(index, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_seed_refuses_filled_database(self):
+        """--seed не пишет в базу с данными без --force"""
+        posts = Post.objects.count()
+        with self.assertRaisesMessage(CommandError, 'База не пуста'):
+            call_command(
+                'explain_listings', seed=10, users=2, groups=1, repeat=1,
+                stdout=StringIO(),
+            )
+        self.assertEqual(Post.objects.count(), posts)
+
+    def test_cursor_pages_seek_by_key(self):
+        """Страницы по курсору after начинаются поиском по индексу"""
+        author = User.objects.order_by('-counters__posts_count').first()
+        group = Group.objects.order_by('-posts_count').first()
+        post = Post.objects.order_by('-comments_count').first()
+        user = User.objects.order_by('-counters__following_count').first()
+        queries = cursor_queries(author, group, post, user)
+        self.assertIn('index after', queries)
+        self.assertIn('follow_index after', queries)
+        for name, queryset in queries.items():
+            with self.subTest(listing=name):
+                plan = queryset.explain()
+                self.assertIn('SEARCH', plan)
+                self.assertNotIn('SCAN', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_explain_command_reports_plans(self):
+        """Команда печатает планы и время запросов"""
+        out = StringIO()
+        call_command('explain_listings', repeat=1, stdout=out)
+        self.assertIn('post_author_date_idx', out.getvalue())
+        self.assertIn('Все запросы идут по индексам', out.getvalue())
+
+
+class GenerateDataTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command(
+            'generate_data', users=50, groups=5, posts=1000, comments=2000,
+            follows=500, seed=1, timeline=True, stdout=StringIO(),
+        )
+
+    def generated(self):
+        return list(Post.objects.order_by('pk').values_list(
+            'author__username', 'group__slug', 'text', 'pub_date'
+        ))
+
+    def test_counts_and_counters(self):
+        """Создаётся заданное число строк, счётчики сходятся"""
+        self.assertEqual(User.objects.count(), 50)
+        self.assertEqual(Group.objects.count(), 5)
+        self.assertEqual(Post.objects.count(), 1000)
+        self.assertEqual(Comment.objects.count(), 2000)
+        self.assertFalse(Follow.objects.filter(user=F('author')).exists())
+        for author in AuthorCounter.objects.all()[:10]:
+            self.assertEqual(
+                author.posts_count, author.user.posts.count()
+            )
+            self.assertEqual(
+                author.followers_count, author.user.following.count()
+            )
+
+    def test_power_law(self):
+        """Немногие авторы пишут большую часть постов"""
+        top = AuthorCounter.objects.order_by('-posts_count')[:5]
+        self.assertGreater(sum(c.posts_count for c in top), 1000 * 0.3)
+        self.assertTrue(
+            Post.objects.filter(group__isnull=True).exists()
+        )
+
+    def test_timeline_matches_fan_out(self):
+        """Ленты совпадают с пересобранными по подпискам"""
+        stored = set(TimelineEntry.objects.values_list('user', 'post'))
+        self.assertTrue(stored)
+        timeline.rebuild()
+        self.assertEqual(
+            set(TimelineEntry.objects.values_list('user', 'post')), stored
+        )
+
+    def test_dates_spread_over_days(self):
+        """Посты и комментарии получают свои даты, а не время вставки"""
+        dates = Post.objects.aggregate(first=Min('pub_date'),
+                                       last=Max('pub_date'))
+        self.assertGreater(dates['last'] - dates['first'], timedelta(days=30))
+        self.assertFalse(
+            Comment.objects.filter(created__lt=F('post__pub_date')).exists()
+        )
+        self.assertTrue(Post._meta.get_field('pub_date').auto_now_add)
+
+    def test_timeline_size_bounded(self):
+        """Ленты сверх предела записей не заполняются"""
+        with self.assertRaisesMessage(CommandError, 'Ленты займут до'):
+            call_command(
+                'generate_data', users=50, seed=2, timeline=True,
+                max_timeline_rows=100, stdout=StringIO(),
+            )
+        self.assertFalse(
+            User.objects.filter(username__startswith='gen2_').exists()
+        )
+
+    def test_same_seed_same_data(self):
+        """Одинаковый seed даёт одинаковые данные, повтор запрещён"""
+        before = self.generated()
+        with self.assertRaises(CommandError):
+            call_command('generate_data', seed=1, stdout=StringIO())
+        Post.objects.all().delete()
+        User.objects.all().delete()
+        Group.objects.all().delete()
+        call_command(
+            'generate_data', users=50, groups=5, posts=1000, comments=2000,
+            follows=500, seed=1, stdout=StringIO(),
+        )
+        after = self.generated()
+        self.assertEqual(
+            [row[:3] for row in before], [row[:3] for row in after]
+        )
+
+
+class GenerateChunksTest(TransactionTestCase):
+    def test_interrupted_run_keeps_committed_chunks(self):
+        """Пачки фиксируются по одной: сбой не откатывает готовые этапы"""
+        with mock.patch.object(
+            synthetic.Generator, 'follows', side_effect=RuntimeError
+        ), self.assertRaises(RuntimeError):
+            synthetic.generate(
+                20, 2, 100, 50, 100, seed=2, chunk_size=30,
+            )
+        self.assertEqual(Post.objects.count(), 100)
+        self.assertEqual(Comment.objects.count(), 50)
+        self.assertFalse(Follow.objects.exists())
@@ -1,7 +1,7 @@
 from http import HTTPStatus
 
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 
 from ..models import Group, Post, User
 
@@ -81,6 +81,8 @@ class PostUrlsTest(TestCase):
             response, (f'/posts/{self.post.id}/')
         )
 
+    # Повторный запрос гостя отдаётся из кэша страниц, без шаблонов.
+    @override_settings(PAGE_CACHE_ENABLED=False)
     def test_templates_for_everyone(self):
         """Проверка шаблонов для всех пользователей"""
         for address, template in self.templates[0].items():
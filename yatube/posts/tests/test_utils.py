@@ -0,0 +1,230 @@
+import warnings
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
+from django.db import connection
+from django.http import Http404
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+
+from .. import identity, timeline
+from ..models import Follow, Group, Post
+from ..utils import KeysetPaginator, paginate_page
+
+User = get_user_model()
+
+
+class KeysetPaginatorTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        Post.objects.bulk_create(
+            Post(author=cls.user, text=f'Пост {i}') for i in range(25)
+        )
+        cls.factory = RequestFactory()
+
+    def walk(self, param, cursor):
+        request = self.factory.get('/', {param: cursor})
+        return paginate_page(request, Post.objects.all())
+
+    def test_walk_forward_and_back(self):
+        """Курсоры обходят все посты без пропусков и повторов"""
+        page = paginate_page(self.factory.get('/'), Post.objects.all())
+        seen = [post.pk for post in page]
+        numbers = [page.number]
+        self.assertFalse(page.has_previous())
+        while page.has_next():
+            page = self.walk('after', page.paginator.next_cursor)
+            seen.extend(post.pk for post in page)
+            numbers.append(page.number)
+        self.assertEqual(numbers, [1, 2, 3])
+        self.assertEqual(page.paginator.num_pages, 3)
+        self.assertEqual(
+            seen,
+            list(Post.objects.order_by('-pub_date', '-pk')
+                 .values_list('pk', flat=True))
+        )
+        self.assertEqual(len(page), 5)
+        back = self.walk('before', page.paginator.previous_cursor)
+        self.assertEqual([post.pk for post in back], seen[10:20])
+        self.assertEqual(back.number, 2)
+        self.assertTrue(back.has_previous())
+        self.assertTrue(back.has_next())
+        first = self.walk('before', back.paginator.previous_cursor)
+        self.assertEqual(first.number, 1)
+        self.assertFalse(first.has_previous())
+
+    def test_merges_sources(self):
+        """Страницы из нескольких источников идут в общем порядке ключа"""
+        first = Post.objects.order_by('pk')[12].pk
+        sources = [
+            Post.objects.filter(pk__lt=first),
+            Post.objects.filter(pk__gte=first),
+        ]
+        expected = list(Post.objects.order_by(
+            '-pub_date', '-pk'
+        ).values_list('pk', flat=True))
+        page = paginate_page(self.factory.get('/'), sources)
+        seen = [post.pk for post in page]
+        while page.has_next():
+            page = paginate_page(
+                self.factory.get('/', {'after': page.paginator.next_cursor}),
+                sources,
+            )
+            seen.extend(post.pk for post in page)
+        self.assertEqual(seen, expected)
+        page = paginate_page(
+            self.factory.get('/', {'before': page.paginator.previous_cursor}),
+            sources,
+        )
+        self.assertEqual([post.pk for post in page], expected[10:20])
+        legacy = paginate_page(self.factory.get('/', {'page': 2}), sources)
+        self.assertEqual([post.pk for post in legacy], expected[10:20])
+
+    def test_constant_queries_and_no_count(self):
+        """Страница — один запрос без COUNT(*) на любой глубине"""
+        page = paginate_page(self.factory.get('/'), Post.objects.all())
+        cursor = page.paginator.next_cursor
+        with self.assertNumQueries(1) as context:
+            self.walk('after', cursor)
+        self.assertNotIn('COUNT', context.captured_queries[0]['sql'])
+
+    def test_broken_cursor_and_legacy_page(self):
+        """Битый курсор ведёт на первую страницу, ?page=N работает"""
+        first = paginate_page(self.factory.get('/'), Post.objects.all())
+        broken = self.walk('after', 'не-курсор')
+        self.assertEqual(list(broken), list(first))
+        legacy = paginate_page(
+            self.factory.get('/', {'page': 3}), Post.objects.all()
+        )
+        self.assertEqual(legacy.number, 3)
+        self.assertEqual(len(legacy), 5)
+        self.assertFalse(legacy.has_next())
+        self.assertIsInstance(legacy.paginator, KeysetPaginator)
+
+
+class DeepCursorPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        Post.objects.bulk_create(
+            Post(author=cls.author, text=f'Пост {i}') for i in range(60)
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        timeline.rebuild()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        cls.factory = RequestFactory()
+
+    def deep_page_query(self, queryset, **kwargs):
+        """SQL страницы по курсору с конца списка."""
+        page = paginate_page(self.factory.get('/'), queryset, **kwargs)
+        for _ in range(4):
+            cursor = page.paginator.next_cursor
+            with CaptureQueriesContext(connection) as context:
+                page = paginate_page(
+                    self.factory.get('/', {'after': cursor}), queryset,
+                    **kwargs
+                )
+            self.assertEqual(len(context), 1)
+        self.assertTrue(page.has_next())
+        return context.captured_queries[0]['sql']
+
+    def test_deep_cursor_uses_index_range(self):
+        """Глубокая страница читается поиском по индексу, а не сканом"""
+        queries = {
+            'index': self.deep_page_query(Post.objects.for_listing()),
+            'feed': self.deep_page_query(
+                timeline.feed(self.reader), key=timeline.FEED_KEY,
+            ),
+        }
+        for name, sql in queries.items():
+            with self.subTest(listing=name), connection.cursor() as cursor:
+                # Диапазон по первому полю ключа, а не только дизъюнкция.
+                self.assertRegex(sql, r'"pub_date" <= [^()]+ AND \(')
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+                self.assertIn('SEARCH', plan)
+                self.assertNotIn('SCAN', plan)
+
+
+class IdentityCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        self.user = User.objects.create_user(username='author')
+
+    def test_cached_lookups_skip_database(self):
+        """Повторный поиск группы и автора не обращается к базе"""
+        identity.get_group('group')
+        identity.get_user('author')
+        with self.assertNumQueries(0):
+            self.assertEqual(identity.get_group('group'), self.group)
+            user = identity.get_user('author')
+            self.assertEqual(user, self.user)
+            self.assertEqual(user.counters.posts_count, 0)
+        self.assertNotIn('password', user.__dict__)
+
+    def test_missing_cached_until_created(self):
+        """Отсутствие запоминается и сбрасывается созданием"""
+        for _ in range(2):
+            with self.assertRaises(Http404):
+                identity.get_group('new')
+        with self.assertNumQueries(0), self.assertRaises(Http404):
+            identity.get_group('new')
+        group = Group.objects.create(title='Новая', slug='new')
+        self.assertEqual(identity.get_group('new'), group)
+
+    def test_missing_entry_in_other_process_expires(self):
+        """Чужая копия записи об отсутствии устаревает при создании"""
+        with self.assertRaises(Http404):
+            identity.get_group('new')
+        key = identity._key('group', 'new')
+        entry = cache.get(key)
+        group = Group.objects.create(title='Новая', slug='new')
+        # Так запись осталась бы в локальном уровне другого процесса.
+        cache.set(key, entry)
+        self.assertEqual(identity.get_group('new'), group)
+
+    def test_writes_invalidate(self):
+        """Счётчики, переименование и удаление видны сразу"""
+        reader = User.objects.create_user(username='reader')
+        identity.get_user('author')
+        identity.get_group('group')
+        Post.objects.create(author=self.user, group=self.group, text='Пост')
+        Follow.objects.create(user=reader, author=self.user)
+        self.assertEqual(identity.get_group('group').posts_count, 1)
+        counters = identity.get_user('author').counters
+        self.assertEqual(
+            (counters.posts_count, counters.followers_count), (1, 1)
+        )
+        self.group.slug = 'renamed'
+        self.group.save()
+        with self.assertRaises(Http404):
+            identity.get_group('group')
+        self.user.delete()
+        with self.assertRaises(Http404):
+            identity.get_user('author')
+
+    def test_key_safe_for_any_slug(self):
+        """Ключ кэша не содержит сам слаг"""
+        slug = 'Тестовый слаг ' + 'x' * 300
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            with self.assertRaises(Http404):
+                identity.get_group(slug)
+        self.assertNotIn('слаг', identity._key('group', slug))
+
+    def test_login_keeps_entry(self):
+        """Вход пользователя не сбрасывает его страницы"""
+        identity.get_user('author')
+        update_last_login(None, self.user)
+        with self.assertNumQueries(0):
+            identity.get_user('author')
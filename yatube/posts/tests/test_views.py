@@ -1,18 +1,25 @@
 import shutil
 import tempfile
+from io import StringIO
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from ..models import Follow, Group, Post, User
+from ..models import (AuthorCounter, Comment, Follow, Group, Post,
+                      TimelineEntry, User)
 
 User = get_user_model()
 
+AUTH_QUERIES = 2  # сессия и пользователь авторизованного клиента
+
 
 class PostViewTest(TestCase):
     @classmethod
@@ -239,15 +246,39 @@ class CacheTests(TestCase):
     def test_cache(self):
         """Тестирование кэша"""
         before_editing = self.authorized_client.get(reverse('posts:index'))
-        post_1 = Post.objects.get(text=self.post.text)
-        post_1.text = 'Изменяем текст'
-        post_1.save()
-        after_editing = self.authorized_client.get(reverse('posts:index'))
-        self.assertEqual(before_editing.content, after_editing.content)
+        Post.objects.filter(pk=self.post.pk).update(text='Мимо сигналов')
+        cached = self.authorized_client.get(reverse('posts:index'))
+        self.assertEqual(before_editing.content, cached.content)
         cache.clear()
         clearing_the_cache = self.authorized_client.get(reverse('posts:index'))
         self.assertNotEqual(before_editing.content, clearing_the_cache.content)
 
+    def test_cache_invalidated_on_write(self):
+        """Запись поста сразу сбрасывает фрагменты списков"""
+        pages = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': self.post.author}),
+        )
+        for page in pages:
+            self.authorized_client.get(page)
+        post_1 = Post.objects.get(pk=self.post.pk)
+        post_1.text = 'Изменяем текст'
+        post_1.save()
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.authorized_client.get(page)
+                self.assertContains(response, 'Изменяем текст')
+
+    def test_follow_cache_is_per_user(self):
+        """Фрагмент ленты не общий для пользователей и для главной"""
+        Follow.objects.create(user=self.user, author=self.post.author)
+        self.authorized_client.get(reverse('posts:index'))
+        own = self.authorized_client.get(reverse('posts:follow_index'))
+        other = self.not_follower.get(reverse('posts:follow_index'))
+        self.assertContains(own, self.post.text)
+        self.assertNotContains(other, self.post.text)
+
     def test_pages_show_correct_context(self):
         """Выводится ли картинка в контекст"""
         for name_page in self.image_list[0]:
@@ -319,3 +350,324 @@ class CacheTests(TestCase):
         self.assertEqual(first, 'Тестовая запись для подписчика')
         response = self.not_follower.get(reverse('posts:follow_index'))
         self.assertNotContains(response, 'Тестовая запись для подписчика')
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, text='Пост', group=cls.group
+        )
+        cls.pages = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:post_detail', kwargs={'post_id': cls.post.id}),
+            reverse('posts:follow_index'),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def revalidate(self, address, response):
+        return self.reader_client.get(
+            address, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+
+    def test_unchanged_page_not_modified(self):
+        """Неизменная страница отдаётся как 304 без шаблона"""
+        for address in self.pages:
+            with self.subTest(address=address):
+                response = self.reader_client.get(address)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('no-cache', response['Cache-Control'])
+                with CaptureQueriesContext(connection) as context:
+                    again = self.revalidate(address, response)
+                self.assertEqual(again.status_code, 304)
+                self.assertEqual(again['ETag'], response['ETag'])
+                self.assertEqual(again.content, b'')
+                self.assertLessEqual(len(context) - AUTH_QUERIES, 1)
+
+    def test_write_changes_etag(self):
+        """Новые пост, комментарий и подписка меняют ETag"""
+        responses = {
+            address: self.reader_client.get(address)
+            for address in self.pages
+        }
+        Post.objects.create(author=self.author, text='Ещё', group=self.group)
+        for address, response in responses.items():
+            with self.subTest(address=address):
+                self.assertEqual(
+                    self.revalidate(address, response).status_code, 200
+                )
+        detail = self.pages[3]
+        response = self.reader_client.get(detail)
+        self.post.comments.create(author=self.reader, text='Комментарий')
+        self.assertEqual(self.revalidate(detail, response).status_code, 200)
+        profile = self.pages[2]
+        response = self.reader_client.get(profile)
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.revalidate(profile, response).status_code, 200)
+
+    def test_renames_refresh_listings(self):
+        """Новые слаг группы и имя автора видны во всех списках"""
+        index, group_page, profile = self.pages[:3]
+        responses = {
+            address: self.reader_client.get(address)
+            for address in self.pages
+        }
+        group = Group.objects.get(pk=self.group.pk)
+        group.slug = 'renamed'
+        group.save()
+        author = User.objects.get(pk=self.author.pk)
+        author.first_name, author.last_name = 'Новое', 'Имя'
+        author.save()
+        renamed = reverse('posts:group_list', kwargs={'slug': 'renamed'})
+        for address in (index, profile, self.pages[3], self.pages[4]):
+            with self.subTest(address=address):
+                self.assertEqual(
+                    self.revalidate(address, responses[address]).status_code,
+                    200,
+                )
+        for address in (index, renamed, profile):
+            with self.subTest(address=address):
+                response = self.reader_client.get(address)
+                self.assertContains(response, 'Новое Имя')
+                self.assertNotContains(response, group_page)
+                if address != renamed:
+                    self.assertContains(response, renamed)
+
+    def test_group_rename_changes_post_etag(self):
+        """Переименование группы меняет ETag страницы её поста"""
+        detail = self.pages[3]
+        response = self.reader_client.get(detail)
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название'
+        group.save()
+        again = self.revalidate(detail, response)
+        self.assertEqual(again.status_code, 200)
+        self.assertContains(again, 'Новое название')
+
+    def test_etag_depends_on_viewer(self):
+        """Гость и пользователь получают разные версии страницы"""
+        address = self.pages[0]
+        response = self.reader_client.get(address)
+        guest = self.client.get(address, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(guest.status_code, 200)
+        self.assertNotEqual(guest['ETag'], response['ETag'])
+
+
+class TimelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.old_post = Post.objects.create(author=cls.author, text='Старый')
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def feed(self):
+        response = self.reader_client.get(reverse('posts:follow_index'))
+        return [post.text for post in response.context['page_obj']]
+
+    def test_fan_out_on_follow_and_post(self):
+        """Подписка заполняет ленту, новый пост раздаётся, отписка чистит"""
+        self.reader_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': self.author}
+        ))
+        Post.objects.create(author=self.author, text='Новый')
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 2
+        )
+        self.assertEqual(self.feed(), ['Новый', 'Старый'])
+        self.reader_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': self.author}
+        ))
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), [])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_popular_author_read_on_demand(self):
+        """Посты популярного автора читаются без раздачи"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        Post.objects.create(author=self.author, text='Новый')
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), ['Новый', 'Старый'])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_author_crosses_fanout_limit(self):
+        """Посты не теряются, когда автор пересекает порог раздачи"""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(author=self.author, text='Популярный')
+        self.assertEqual(self.feed(), ['Популярный', 'Старый'])
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(self.feed(), ['Популярный', 'Старый'])
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(author=self.author, text='Снова')
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(self.feed(), ['Снова', 'Популярный', 'Старый'])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=4)
+    def test_author_resumes_fan_out_in_settle(self):
+        """Отписка не раздаёт посты, к раздаче автор вернётся в settle"""
+        other = User.objects.create_user(username='other')
+        Follow.objects.create(user=self.reader, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        Post.objects.create(author=self.author, text='Второй')
+        Post.objects.create(author=self.author, text='Третий')
+        counter = AuthorCounter.objects.filter(user=self.author)
+        self.assertFalse(counter.get().timeline_pushed)
+        Follow.objects.filter(user=other).delete()
+        self.assertFalse(counter.get().timeline_pushed)
+        call_command('rebuild_timeline', settle=True, stdout=StringIO())
+        self.assertFalse(counter.get().timeline_pushed)
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertEqual(self.feed(), ['Третий', 'Второй', 'Старый'])
+        Post.objects.filter(text='Третий').delete()
+        call_command('rebuild_timeline', settle=True, stdout=StringIO())
+        self.assertTrue(counter.get().timeline_pushed)
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+        self.assertEqual(self.feed(), ['Второй', 'Старый'])
+
+    @override_settings(TIMELINE_MAX_ENTRIES=2)
+    def test_timeline_capped(self):
+        """Лента хранит не больше предела последних постов"""
+        Post.objects.create(author=self.author, text='Второй')
+        Post.objects.create(author=self.author, text='Третий')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.feed(), ['Третий', 'Второй'])
+        Post.objects.create(author=self.author, text='Четвёртый')
+        call_command('rebuild_timeline', settle=True, stdout=StringIO())
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+        self.assertEqual(self.feed(), ['Четвёртый', 'Третий'])
+
+    def test_rebuild_command(self):
+        """Команда пересобирает ленты по подпискам"""
+        Follow.objects.create(user=self.reader, author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timeline', stdout=StringIO())
+        self.assertEqual(self.feed(), ['Старый'])
+
+
+@override_settings(COMMENTS_PER_PAGE=3)
+class CommentPaginationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+        # Одно время создания у всех: порядок держится на pk.
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.author, text=f'Отзыв {i}')
+            for i in range(7)
+        )
+
+    def test_first_page_capped(self):
+        """Пост показывает первую порцию комментариев и ссылку на ещё"""
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        comments = response.context['comments']
+        self.assertEqual(
+            [comment.text for comment in comments],
+            ['Отзыв 0', 'Отзыв 1', 'Отзыв 2'],
+        )
+        self.assertTrue(comments.has_next())
+        self.assertContains(response, 'data-more-comments')
+
+    def test_load_more_walks_all_comments(self):
+        """«Показать ещё» отдаёт фрагменты до последнего комментария"""
+        address = reverse(
+            'posts:post_comments', kwargs={'post_id': self.post.pk}
+        )
+        seen, params = [], {}
+        while params is not None:
+            response = self.client.get(address, params)
+            self.assertNotContains(response, '<html')
+            comments = response.context['comments']
+            seen += [comment.text for comment in comments]
+            params = None
+            if comments.has_next():
+                params = {'after': comments.paginator.next_cursor}
+        self.assertEqual(seen, [f'Отзыв {i}' for i in range(7)])
+        self.assertNotContains(response, 'data-more-comments')
+
+    def test_missing_post(self):
+        response = self.client.get(
+            reverse('posts:post_comments', kwargs={'post_id': 0})
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class QueryBudgetTest(TestCase):
+    """Число запросов страницы не зависит от числа постов на ней"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание'
+        )
+        cls.authors = [
+            User.objects.create_user(username=f'author{i}') for i in range(3)
+        ]
+        for author in cls.authors:
+            Follow.objects.create(user=cls.reader, author=author)
+        cls.post = Post.objects.create(
+            author=cls.authors[0], text='Пост', group=cls.group
+        )
+        cls.budgets = {
+            reverse('posts:index'): 1,
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}): 2,
+            reverse('posts:profile', kwargs={'username': 'author0'}): 3,
+            reverse('posts:post_detail', kwargs={'post_id': cls.post.id}): 2,
+            reverse('posts:follow_index'): 4,
+        }
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def count_queries(self, address):
+        with CaptureQueriesContext(connection) as context:
+            self.reader_client.get(address)
+        return len(context)
+
+    def add_rows(self):
+        for i in range(9):
+            post = Post.objects.create(
+                author=self.authors[i % 3], text=f'Пост {i}', group=self.group
+            )
+        for author in self.authors:
+            self.post.comments.create(author=author, text='Комментарий')
+        return post
+
+    def test_views_within_budget(self):
+        """Страницы укладываются в бюджет запросов"""
+        self.reader_client.get(reverse('posts:index'))
+        before = {
+            address: self.count_queries(address) for address in self.budgets
+        }
+        self.add_rows()
+        for address, budget in self.budgets.items():
+            with self.subTest(address=address):
+                queries = self.count_queries(address)
+                self.assertEqual(queries, before[address])
+                self.assertLessEqual(queries - AUTH_QUERIES, budget)
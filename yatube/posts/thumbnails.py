@@ -0,0 +1,159 @@
+""" Фоновая генерация миниатюр картинок постов.
+
+Шаблоны не создают миниатюры сами: они берут готовую из хранилища
+ключей sorl (`ready`) или показывают заглушку и ставят картинку
+в очередь пула потоков. После генерации сдвигаются поколения кэша
+поста, чтобы закэшированные списки заменили заглушку на миниатюру.
+
+Имя файла миниатюры строит только `get_thumbnail`, поэтому после
+генерации оно запоминается в кэше, а готовность проверяется по
+хранилищу ключей sorl. Картинка, которой нет в хранилище файлов, тоже
+запоминается на `THUMBNAIL_MISSING_TIMEOUT`, чтобы каждый показ поста
+не ставил её в очередь заново.
+"""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core import instrumentation, metrics
+from core.cache import bump
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, transaction
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.images import ImageFile
+
+logger = logging.getLogger(__name__)
+
+# Миниатюры, которые выводят шаблоны постов: имя -> (геометрия, опции).
+GEOMETRIES = {
+    'post': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+
+# Имя файла миниатюры и отметка об отсутствующей картинке.
+KEY = 'thumbnail:{}:{}'
+MISSING_KEY = 'thumbnail-missing:{}'
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def _digest(image):
+    return hashlib.md5(image.encode()).hexdigest()
+
+
+def generate(image):
+    """ Создаёт все миниатюры картинки и запоминает имена их файлов. """
+    if not default.storage.exists(image):
+        logger.warning('Картинка %s не найдена в хранилище', image)
+        cache.set(
+            MISSING_KEY.format(_digest(image)), True,
+            settings.THUMBNAIL_MISSING_TIMEOUT,
+        )
+        return
+    cache.delete(MISSING_KEY.format(_digest(image)))
+    begin = time.perf_counter()
+    with instrumentation.timer('thumbnail'):
+        for name, (geometry, options) in GEOMETRIES.items():
+            thumbnail = get_thumbnail(image, geometry, **options)
+            cache.set(KEY.format(name, _digest(image)), thumbnail.name, None)
+    metrics.observe_thumbnail(time.perf_counter() - begin)
+
+
+def missing(image):
+    """ Не находилась ли картинка в хранилище недавно. """
+    return bool(cache.get(MISSING_KEY.format(_digest(image))))
+
+
+def _run(image, scopes):
+    try:
+        generate(image)
+        bump(*scopes)
+    except Exception:
+        logger.exception('Не удалось создать миниатюру %s', image)
+    finally:
+        with _lock:
+            _pending.discard(image)
+
+
+def _work(image, scopes):
+    try:
+        _run(image, scopes)
+    finally:
+        # Соединения рабочего потока не закрываются обработчиком
+        # request_finished, как у запросов.
+        connections.close_all()
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def shutdown():
+    """ Дожидается задач пула и останавливает его.
+
+    Следующая задача создаст новый пул.
+    """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=True)
+
+
+def _submit(image, scopes):
+    with _lock:
+        if image in _pending:
+            return
+        _pending.add(image)
+    if not settings.THUMBNAIL_ASYNC:
+        # Без пула заглушки не выводятся, и закэшированные страницы
+        # сбрасывать незачем.
+        _run(image, ())
+        return
+    _get_executor().submit(_work, image, scopes)
+
+
+def schedule(post):
+    """ Ставит миниатюры картинки поста в очередь (один раз).
+
+    Рабочий поток читает картинку и пишет в хранилище ключей через своё
+    соединение, поэтому задача отправляется после фиксации транзакции.
+    """
+    image, scopes = post.image.name, post.cache_scopes()
+    if not settings.THUMBNAIL_ASYNC:
+        _submit(image, scopes)
+        return
+    transaction.on_commit(lambda: _submit(image, scopes))
+
+
+def cached(image, name='post'):
+    """ Миниатюра из хранилища ключей sorl или None. """
+    thumbnail = cache.get(KEY.format(name, _digest(image)))
+    if thumbnail is None:
+        return None
+    return default.kvstore.get(ImageFile(thumbnail, default.storage))
+
+
+def ready(post, name='post'):
+    """ Готовая миниатюра или None; исходник читается, только если
+    миниатюры нет и пул выключен (THUMBNAIL_ASYNC).
+    """
+    if not post.image:
+        return None
+    thumbnail = cached(post.image.name, name)
+    if thumbnail is None and not missing(post.image.name):
+        schedule(post)
+        if not settings.THUMBNAIL_ASYNC:
+            thumbnail = cached(post.image.name, name)
+    return thumbnail
@@ -0,0 +1,254 @@
+""" Лента подписок с раздачей постов при записи (fan-out-on-write).
+
+Новый пост автора копируется в `TimelineEntry` каждого подписчика,
+поэтому лента читается диапазоном по индексу `(user, -pub_date, -post)`.
+В ленте хранятся только последние `TIMELINE_MAX_ENTRIES` постов: подписка
+материализует не больше стольких постов автора, а `trim` срезает ленту
+до предела (при подписке — сразу, после раздачи — в `settle`).
+
+Стоимость автора — сколько записей лент он держит: подписчики × посты,
+не больше предела ленты на подписчика. Автор дороже
+`TIMELINE_FANOUT_LIMIT` переходит на чтение по запросу сразу, как только
+это замечает раздача или подписка (`AuthorCounter.timeline_pushed`).
+Обратно — только в `settle` (`rebuild_timeline --settle`), когда
+стоимость опустится до `RESUME_SHARE` порога: запас не даёт автору у
+порога метаться между режимами, а раздача всех его постов не выполняется
+в запросе отписки.
+
+Посты авторов, читаемых по запросу, не смешиваются с лентой в одном
+запросе: `feed` отдаёт отдельные источники, каждый — диапазон своего
+индекса, а `KeysetPaginator` сливает окна страниц по ключу `FEED_KEY`.
+"""
+from itertools import islice
+
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db.models import Count, F, Q
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from .models import AuthorCounter, Follow, Post, TimelineEntry
+
+CHUNK_SIZE = 1000
+FEED_KEY = ('feed_date', 'feed_post')
+# Доля порога, до которой должна опуститься стоимость автора, чтобы его
+# посты снова раздавались.
+RESUME_SHARE = 0.5
+
+
+def fanout_limit():
+    return getattr(settings, 'TIMELINE_FANOUT_LIMIT', 100000)
+
+
+def max_entries():
+    return getattr(settings, 'TIMELINE_MAX_ENTRIES', 200)
+
+
+def fanout_cost(followers, posts):
+    """ Сколько записей лент материализует автор. """
+    return followers * min(posts, max_entries())
+
+
+def _with_cost(counters):
+    return counters.annotate(fanout_cost=F('followers_count') * Least(
+        F('posts_count'), max_entries()
+    ))
+
+
+def is_pushed(author):
+    """ Раздаются ли посты автора в ленты.
+
+    Переводит автора на чтение по запросу, если его стоимость
+    превысила порог; обратный переход — только в `settle`.
+    """
+    counter = AuthorCounter.objects.filter(user=author).values_list(
+        'timeline_pushed', 'followers_count', 'posts_count'
+    ).first()
+    if counter is None:
+        return True
+    pushed, followers, posts = counter
+    if pushed and fanout_cost(followers, posts) > fanout_limit():
+        AuthorCounter.objects.filter(user=author).update(
+            timeline_pushed=False
+        )
+        return False
+    return pushed
+
+
+def _bulk_insert(entries):
+    entries = iter(entries)
+    chunk = list(islice(entries, CHUNK_SIZE))
+    while chunk:
+        TimelineEntry.objects.bulk_create(chunk, ignore_conflicts=True)
+        chunk = list(islice(entries, CHUNK_SIZE))
+
+
+def fan_out(post):
+    """ Кладёт новый пост в ленты подписчиков автора. """
+    if not is_pushed(post.author_id):
+        return
+    followers = Follow.objects.filter(
+        author=post.author_id
+    ).values_list('user_id', flat=True)
+    _bulk_insert(
+        TimelineEntry(
+            user_id=user_id,
+            post=post,
+            author_id=post.author_id,
+            pub_date=post.pub_date,
+        )
+        for user_id in followers.iterator(chunk_size=CHUNK_SIZE)
+    )
+
+
+def _materialize(user_id, author_id):
+    """ Кладёт в ленту последние посты автора, не больше предела. """
+    posts = Post.objects.filter(author=author_id).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:max_entries()]
+    _bulk_insert(
+        TimelineEntry(
+            user_id=user_id,
+            post_id=post_id,
+            author_id=author_id,
+            pub_date=pub_date,
+        )
+        for post_id, pub_date in posts
+    )
+
+
+def follow(user, author):
+    """ Заполняет ленту постами автора после подписки. """
+    if not is_pushed(author):
+        return
+    user_id = getattr(user, 'pk', user)
+    _materialize(user_id, getattr(author, 'pk', author))
+    trim([user_id])
+
+
+def unfollow(user, author):
+    """ Убирает посты автора из ленты. """
+    TimelineEntry.objects.filter(user=user, author=author).delete()
+
+
+def trim(users=None):
+    """ Срезает ленты до `TIMELINE_MAX_ENTRIES` последних записей.
+
+    Без `users` — все ленты длиннее предела. Отдаёт число удалённых.
+    """
+    limit = max_entries()
+    if users is None:
+        users = (
+            TimelineEntry.objects.order_by().values('user')
+            .annotate(total=Count('pk')).filter(total__gt=limit)
+            .values_list('user', flat=True)
+        )
+    removed = 0
+    for user_id in users:
+        entries = TimelineEntry.objects.filter(user=user_id)
+        last = entries.order_by('-pub_date', '-post').values_list(
+            'pub_date', 'post'
+        )[limit - 1:limit].first()
+        if last is None:
+            continue
+        pub_date, post_id = last
+        removed += entries.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, post__lt=post_id)
+        ).delete()[0]
+    return removed
+
+
+def _resume(author_id):
+    """ Возвращает автора к раздаче: его посты — во все ленты. """
+    started = timezone.now()
+    followers = Follow.objects.filter(
+        author=author_id
+    ).values_list('user_id', flat=True)
+    for user_id in followers.iterator(chunk_size=CHUNK_SIZE):
+        _materialize(user_id, author_id)
+    AuthorCounter.objects.filter(user=author_id).update(timeline_pushed=True)
+    # Посты, написанные во время раздачи, ещё шли мимо лент.
+    for post in Post.objects.filter(author=author_id, pub_date__gte=started):
+        fan_out(post)
+
+
+def pull_expensive(apps=global_apps):
+    """ Переводит авторов дороже порога на чтение по запросу и удаляет
+    записи лент всех таких авторов. Принимает реестр моделей миграции.
+    """
+    counter_model = apps.get_model('posts', 'AuthorCounter')
+    entry_model = apps.get_model('posts', 'TimelineEntry')
+    pulled = list(_with_cost(counter_model.objects.filter(
+        timeline_pushed=True
+    )).filter(
+        fanout_cost__gt=fanout_limit()
+    ).values_list('user', flat=True))
+    counter_model.objects.filter(user__in=pulled).update(
+        timeline_pushed=False
+    )
+    # Записи, оставшиеся от раздачи до перехода, лента уже не читает.
+    entry_model.objects.filter(
+        author__counters__timeline_pushed=False
+    ).delete()
+    return len(pulled)
+
+
+def settle():
+    """ Переключает авторов между раздачей и чтением по запросу и
+    срезает ленты. Отдаёт число переключённых авторов в каждую сторону.
+    """
+    pulled = pull_expensive()
+    resumed = list(_with_cost(AuthorCounter.objects.filter(
+        timeline_pushed=False
+    )).filter(
+        fanout_cost__lte=fanout_limit() * RESUME_SHARE
+    ).values_list('user', flat=True))
+    for author_id in resumed:
+        _resume(author_id)
+    trim()
+    return pulled, len(resumed)
+
+
+def rebuild(users=None):
+    """ Пересобирает ленты с нуля, возвращает число записей. """
+    entries = TimelineEntry.objects.all()
+    follows = Follow.objects.all()
+    if users is not None:
+        entries = entries.filter(user__in=users)
+        follows = follows.filter(user__in=users)
+    entries.delete()
+    follows = follows.order_by('user')
+    for user_id, author_id in follows.values_list('user_id', 'author_id'):
+        if is_pushed(author_id):
+            _materialize(user_id, author_id)
+    trim(follows.values_list('user', flat=True).distinct())
+    return TimelineEntry.objects.filter(
+        user__in=follows.values('user')
+    ).count()
+
+
+def pulled_authors(user):
+    """ Авторы из подписок, чьи посты читаются по запросу. """
+    return list(Follow.objects.filter(
+        user=user, author__counters__timeline_pushed=False,
+    ).values_list('author', flat=True))
+
+
+def feed(user):
+    """ Источники ленты для `KeysetPaginator`: записи ленты и посты
+    каждого автора, читаемого по запросу; все упорядочиваются `FEED_KEY`.
+    """
+    pulled = pulled_authors(user)
+    stored = Post.objects.filter(timeline__user=user).annotate(
+        feed_date=F('timeline__pub_date'),
+        feed_post=F('timeline__post'),
+    )
+    if pulled:
+        # Записи, оставшиеся от раздачи до перехода, до `settle`.
+        stored = stored.exclude(author__in=pulled)
+    return [stored.for_listing(), *(
+        Post.objects.filter(author=author_id).annotate(
+            feed_date=F('pub_date'), feed_post=F('pk'),
+        ).for_listing()
+        for author_id in pulled
+    )]
@@ -1,8 +1,246 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import heapq
+from itertools import islice
 
+from core import instrumentation, page_cache
+from core.cache import fragment_key, generations, page_etag, read_scopes
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.cache import get_conditional_response, patch_cache_control
 
-def paginate_page(request, post_list, post_per_page=10):
+CURSOR_SEPARATOR = '|'
+
+
+class KeysetPaginator(Paginator):
+    """ Пагинатор по ключу (курсору) вместо OFFSET.
+
+    Страница выбирается условием по ключу сортировки
+    `(pub_date, pk)` и `LIMIT per_page + 1`, поэтому её стоимость
+    не зависит от глубины и не требует `COUNT(*)`.
+    Курсоры `after`/`before` — непрозрачные токены; в них же номер
+    страницы строки, чтобы следующая знала свой номер. Число страниц
+    без подсчёта неизвестно: `num_pages` — номер текущей, плюс один,
+    если есть следующая.
+    Вместо запроса можно передать список запросов с одинаковым ключом:
+    окно читается из каждого, и окна сливаются по ключу.
+    """
+
+    def __init__(self, object_list, per_page, key=('pub_date', 'pk'),
+                 descending=True):
+        self.key = key
+        self.descending = descending
+        self.next_cursor = None
+        self.previous_cursor = None
+        self._num_pages = 1
+        ordering = [('-' if descending else '') + name for name in key]
+        if not isinstance(object_list, (list, tuple)):
+            object_list = [object_list]
+        self.sources = [source.order_by(*ordering) for source in object_list]
+        super().__init__(self.sources[0], per_page)
+
+    @property
+    def num_pages(self):
+        return self._num_pages
+
+    def _key_field(self, name):
+        opts = self.object_list.model._meta
+        if name == 'pk':
+            return opts.pk
+        try:
+            return opts.get_field(name)
+        except FieldDoesNotExist:
+            return self.object_list.query.annotations[name].output_field
+
+    def encode_cursor(self, obj, number):
+        values = [getattr(obj, name) for name in self.key]
+        raw = CURSOR_SEPARATOR.join([str(number), *(
+            value.isoformat() if hasattr(value, 'isoformat') else str(value)
+            for value in values
+        )])
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """ Номер страницы и значения ключа или None для битого курсора.
+
+        В курсорах, выданных до появления номера, его нет: номер None.
+        """
+        try:
+            raw = base64.urlsafe_b64decode(
+                cursor + '=' * (-len(cursor) % 4)
+            ).decode()
+            parts = raw.split(CURSOR_SEPARATOR)
+            number = None
+            if len(parts) == len(self.key) + 1:
+                number = max(int(parts.pop(0)), 1)
+            if len(parts) != len(self.key):
+                return None
+            return number, [
+                self._key_field(name).to_python(part)
+                for name, part in zip(self.key, parts)
+            ]
+        except (binascii.Error, UnicodeDecodeError, ValidationError,
+                ValueError):
+            return None
+
+    def _seek(self, values, forward):
+        """ Условие «строго после/до ключа» в порядке сортировки.
+
+        Дизъюнкция дополнена диапазоном по первому полю ключа: без него
+        SQLite просматривает индекс с начала и пропускает все строки до
+        курсора, и глубокие страницы становятся медленнее первых.
+        """
+        older = forward == self.descending
+        lookup = 'lt' if older else 'gt'
+        condition = Q()
+        for index, name in enumerate(self.key):
+            prefix = {
+                self.key[i]: values[i] for i in range(index)
+            }
+            condition |= Q(**prefix, **{f'{name}__{lookup}': values[index]})
+        bound = Q(**{f'{self.key[0]}__{lookup}e': values[0]})
+        return bound & condition
+
+    def windows(self, values=None, forward=True, offset=0):
+        """ Запросы окна страницы в каждом источнике.
+
+        Из нескольких источников строки читаются с начала: какие из них
+        попадут в окно после слияния, заранее неизвестно.
+        """
+        start = offset if len(self.sources) == 1 else 0
+        queries = []
+        for queryset in self.sources:
+            if values is not None:
+                queryset = queryset.filter(self._seek(values, forward))
+            if not forward:
+                queryset = queryset.reverse()
+            queries.append(queryset[start:offset + self.per_page + 1])
+        return queries
+
+    def window(self, values=None, forward=True, offset=0):
+        """ Окно страницы: `per_page + 1` строк от ключа.
+
+        Для одного источника — запрос, для нескольких — список строк.
+        """
+        queries = self.windows(values, forward, offset)
+        if len(queries) == 1:
+            return queries[0]
+        rows = heapq.merge(
+            *queries, key=self._sort_key, reverse=forward == self.descending
+        )
+        return list(islice(rows, offset, offset + self.per_page + 1))
+
+    def _sort_key(self, obj):
+        return tuple(getattr(obj, name) for name in self.key)
+
+    def _window(self, values=None, forward=True, offset=0):
+        rows = list(self.window(values, forward, offset))
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+        return rows, has_more
+
+    def _build_page(self, rows, number, has_next):
+        self._num_pages = number + 1 if has_next else number
+        if rows:
+            self.previous_cursor = self.encode_cursor(rows[0], number)
+            self.next_cursor = self.encode_cursor(rows[-1], number)
+        return Page(rows, number, self)
+
+    def get_page(self, number=None, after=None, before=None):
+        """ Страница по курсору `after`/`before` или по номеру.
+
+        Номер поддерживается для старых ссылок `?page=N`: он читает
+        окно через OFFSET без подсчёта строк. Битые курсоры и номера
+        ведут на первую страницу.
+        """
+        for cursor, forward in ((after, True), (before, False)):
+            decoded = cursor and self.decode_cursor(cursor)
+            if not decoded:
+                continue
+            depth, values = decoded
+            rows, has_more = self._window(values, forward)
+            if rows and forward:
+                return self._build_page(rows, (depth or 1) + 1, has_more)
+            if rows:
+                # Без предыдущих строк это первая страница, даже если
+                # с выдачи курсора сверху добавились посты.
+                number = max((depth or 3) - 1, 2) if has_more else 1
+                return self._build_page(rows, number, True)
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        rows, has_more = self._window(offset=(number - 1) * self.per_page)
+        if not rows and number > 1:
+            number = 1
+            rows, has_more = self._window()
+        return self._build_page(rows, number, has_more)
+
+
+def paginate_page(request, post_list, post_per_page=10, **kwargs):
     """ Paginator """
-    paginator = Paginator(post_list, post_per_page)
-    page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    paginator = KeysetPaginator(post_list, post_per_page, **kwargs)
+    with instrumentation.timer('paginator'):
+        return paginator.get_page(
+            request.GET.get('page'),
+            after=request.GET.get('after'),
+            before=request.GET.get('before'),
+        )
+
+
+def comments_page(comments, after=None):
+    """ Окно комментариев поста от старых к новым по (created, pk).
+
+    Страница не больше `COMMENTS_PER_PAGE`, дальше — по курсору `after`.
+    """
+    paginator = KeysetPaginator(
+        comments, settings.COMMENTS_PER_PAGE, key=('created', 'pk'),
+        descending=False,
+    )
+    with instrumentation.timer('paginator'):
+        return paginator.get_page(after=after)
+
+
+def listing_cache(page_obj, *parts, scopes=()):
+    """ Ключ и TTL фрагмента списка: окно страницы и поколения данных. """
+    return {
+        'cache_key': fragment_key(
+            *parts,
+            page_obj.number,
+            page_obj.paginator.previous_cursor or '',
+            scopes=scopes,
+        ),
+        'cache_timeout': settings.LISTING_CACHE_TIMEOUT,
+    }
+
+
+def add_etag(request, response, versions):
+    """ Валидатор страницы; браузер перепроверяет её при каждом показе. """
+    response['ETag'] = page_etag(request, versions)
+    patch_cache_control(response, no_cache=True)
+    if request.user.is_authenticated:
+        patch_cache_control(response, private=True)
+    return response
+
+
+def not_modified(request, *scopes):
+    """ Поколения областей страницы и ответ 304, если версия та же.
+
+    Тег считается по поколениям из кэша, без запросов к базе, так что
+    при совпадении ни списки, ни шаблон не вычисляются. Поколения
+    читаются до рендеринга: запись во время него даст новый тег. Те же
+    области помечают страницу для кэша страниц гостей.
+    """
+    scopes = read_scopes(scopes)
+    versions = generations(*scopes)
+    page_cache.mark(request, scopes, versions)
+    response = get_conditional_response(
+        request, etag=page_etag(request, versions)
+    )
+    if response is not None:
+        add_etag(request, response, versions)
+    return versions, response
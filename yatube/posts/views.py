@@ -2,63 +2,122 @@ from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
 
+from . import identity, timeline
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
-from .utils import paginate_page
+from .models import Follow, Post
+from .utils import (add_etag, comments_page, listing_cache, not_modified,
+                    paginate_page)
 
 
 def index(request):
-    post_list = Post.objects.all()
+    scopes = ['posts', 'names']
+    versions, response = not_modified(request, *scopes)
+    if response is not None:
+        return response
+    post_list = Post.objects.for_listing()
+    page_obj = paginate_page(request, post_list)
     context = {
-        "page_obj": paginate_page(request, post_list),
+        "page_obj": page_obj,
+        **listing_cache(page_obj, scopes=scopes),
     }
-    return render(request, 'posts/index.html', context)
+    return add_etag(
+        request, render(request, 'posts/index.html', context), versions
+    )
 
 
 def group_posts(request, slug):
-    group = get_object_or_404(Group, slug=slug)
-    post_list = group.group.all()
+    group = identity.get_group(slug)
+    scopes = [f'group:{group.pk}', 'names']
+    versions, response = not_modified(request, *scopes)
+    if response is not None:
+        return response
+    post_list = group.group.for_listing()
+    page_obj = paginate_page(request, post_list)
     context = {
         "group": group,
-        "page_obj": paginate_page(request, post_list),
+        "page_obj": page_obj,
+        **listing_cache(page_obj, scopes=scopes),
     }
-    return render(request, 'posts/group_list.html', context)
+    return add_etag(
+        request, render(request, 'posts/group_list.html', context), versions
+    )
 
 
 def profile(request, username):
-    author_id = get_object_or_404(User, username=username)
-    post_list = author_id.posts.all()
+    author_id = identity.get_user(username)
+    scopes = [f'author:{author_id.pk}', 'names']
+    # Кнопка подписки зависит от подписок зрителя.
+    versions, response = not_modified(
+        request, *scopes, f'feed:{request.user.pk}'
+    )
+    if response is not None:
+        return response
+    post_list = author_id.posts.for_listing()
     following = request.user.is_authenticated and Follow.objects.filter(
         user=request.user, author=author_id
     ).exists()
+    page_obj = paginate_page(request, post_list)
     context = {
-        "page_obj": paginate_page(request, post_list),
+        "page_obj": page_obj,
         "author_id": author_id,
         "post_list": post_list,
-        "following": following
+        "following": following,
+        **listing_cache(page_obj, scopes=scopes),
     }
-    return render(request, 'posts/profile.html', context)
+    return add_etag(
+        request, render(request, 'posts/profile.html', context), versions
+    )
 
 
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.select_related('author__counters', 'group'),
+        pk=post_id
+    )
+    # Название группы выводится на странице поста, как и в её списке.
+    scopes = [f'post:{post.pk}', f'author:{post.author_id}', 'names']
+    if post.group_id is not None:
+        scopes.append(f'group:{post.group_id}')
+    versions, response = not_modified(request, *scopes)
+    if response is not None:
+        return response
     form = CommentForm()
-    comments = post.comments.all()
+    comments = comments_page(post.comments.for_listing())
     context = {
         "post": post,
         "form": form,
         "comments": comments,
     }
-    return render(request, 'posts/post_detail.html', context)
+    return add_etag(
+        request, render(request, 'posts/post_detail.html', context), versions
+    )
+
+
+def post_comments(request, post_id):
+    """ Следующие комментарии поста фрагментом HTML для «Показать ещё». """
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    versions, response = not_modified(request, f'post:{post.pk}', 'names')
+    if response is not None:
+        return response
+    comments = comments_page(
+        post.comments.for_listing(), request.GET.get('after')
+    )
+    context = {
+        "post": post,
+        "comments": comments,
+    }
+    return add_etag(
+        request, render(request, 'includes/comment_list.html', context),
+        versions
+    )
 
 
 @login_required
 def post_create(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
-        post = form.save(commit=False)
-        post.author = request.user
-        post.save()
+        form.instance.author = request.user
+        form.save()
         return redirect('posts:profile', username=request.user.username)
     context = {
         "form": form,
@@ -107,16 +166,24 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
+    scopes = ['posts', f'feed:{request.user.pk}', 'names']
+    versions, response = not_modified(request, *scopes)
+    if response is not None:
+        return response
+    post_list = timeline.feed(request.user)
+    page_obj = paginate_page(request, post_list, key=timeline.FEED_KEY)
     context = {
-        "page_obj": paginate_page(request, post_list)
+        "page_obj": page_obj,
+        **listing_cache(page_obj, request.user.pk, scopes=scopes),
     }
-    return render(request, 'posts/follow.html', context)
+    return add_etag(
+        request, render(request, 'posts/follow.html', context), versions
+    )
 
 
 @login_required
 def profile_follow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = identity.get_user(username)
     follower = Follow.objects.filter(user=request.user, author=author).exists()
     if request.user != author and not follower:
         Follow.objects.get_or_create(user=request.user, author=author)
@@ -127,6 +194,6 @@ def profile_follow(request, username):
 
 @login_required
 def profile_unfollow(request, username):
-    author = get_object_or_404(User, username=username)
+    author = identity.get_user(username)
     Follow.objects.filter(user=request.user, author=author).delete()
     return redirect('posts:profile', username=author)
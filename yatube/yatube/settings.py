@@ -2,6 +2,10 @@ import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+# Каталог файлов, которые проект пишет при работе: кэш, метрики, журнал
+# медленных запросов и профили. Тесты переносят его (settings_test).
+RUNTIME_DIR = BASE_DIR
+
 
 SECRET_KEY = 'v&t=s3u)zdvd6qpx@0j8!ih3cy=!1%-s-ldnf&x*dapsvnpx=h'
 
@@ -30,11 +34,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaStickinessMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.PageCacheMiddleware',
+    'core.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -44,7 +52,7 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backends.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -64,11 +72,33 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # WAL, настройки соединения и повтор при занятой базе.
+        'ENGINE': 'core.db.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+        'OPTIONS': {
+            'timeout': 5,
+            'busy_retries': 3,
+        },
     }
 }
 
+# Реплики для чтения. Локально это копии файла базы, которые обновляет
+# команда sync_replicas; в продакшене — любые бэкенды, добавленные
+# в DATABASES и DATABASE_REPLICAS.
+LOCAL_REPLICAS = 0
+DATABASE_REPLICAS = []
+for number in range(1, LOCAL_REPLICAS + 1):
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'NAME': os.path.join(BASE_DIR, f'db.replica{number}.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+DATABASE_ROUTERS = ['core.db.routers.PrimaryReplicaRouter']
+# Сколько секунд после записи пользователь читает из основной базы.
+REPLICA_STICKY_SECONDS = 10
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -113,8 +143,109 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Горячие ключи читаются из LRU процесса (core.cache_backends.TieredCache),
+# остальные — из общего для воркеров файла.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache_backends.TieredCache',
+        'LOCATION': 'shared',
+        'OPTIONS': {
+            'MAX_ENTRIES': 500,
+            'LOCAL_TIMEOUT': 5,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(RUNTIME_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+}
+
+# Лента подписок хранит последние TIMELINE_MAX_ENTRIES постов. Авторы,
+# чьи посты заняли бы больше TIMELINE_FANOUT_LIMIT записей лент
+# (подписчики × посты), не раздаются при записи: их посты читаются при
+# открытии ленты (posts.timeline).
+TIMELINE_FANOUT_LIMIT = 100000
+TIMELINE_MAX_ENTRIES = 200
+
+# Фрагменты списков постов инвалидируются поколениями (core.cache),
+# поэтому TTL может быть долгим.
+LISTING_CACHE_TIMEOUT = 60 * 60 * 3
+
+# Комментарии поста показываются порциями, следующие — по «Показать ещё».
+COMMENTS_PER_PAGE = 50
+
+# Группы и пользователи по слагу и имени (posts.identity) тоже
+# сбрасываются поколениями; отсутствие помнится недолго.
+IDENTITY_CACHE_TIMEOUT = 60 * 60 * 24
+IDENTITY_MISSING_TIMEOUT = 60
+
+# Миниатюры картинок создаются пулом потоков после сохранения поста,
+# пока их нет, шаблоны показывают заглушку. False — создаются сразу,
+# при сохранении и выводе поста.
+THUMBNAIL_ASYNC = True
+THUMBNAIL_WORKERS = 2
+# Сколько помнить, что картинки поста нет в хранилище.
+THUMBNAIL_MISSING_TIMEOUT = 60 * 60
+
+# Фрагменты и страницы в кэше пересчитываются заранее с вероятностью,
+# растущей к истечению (core.cache.Entry.due); 0 — только по истечении.
+CACHE_EARLY_BETA = 1.0
+
+# Страницы гостей целиком из кэша (core.page_cache), сбрасываются
+# поколениями областей данных.
+PAGE_CACHE_ENABLED = True
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Метрики узла (core.metrics): процессы сбрасывают приращения в общий
+# файл не чаще раза в METRICS_FLUSH_INTERVAL секунд. /metrics отдаётся
+# только с заголовком `Authorization: Bearer <METRICS_TOKEN>`; без
+# токена адрес выключен.
+METRICS_PATH = os.path.join(RUNTIME_DIR, 'metrics.sqlite3')
+METRICS_FLUSH_INTERVAL = 1
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+INTERNAL_IPS = ['127.0.0.1', '::1']
+
+# Запросы к базе дольше SLOW_QUERY_MS пишутся в SLOW_QUERY_LOG (JSON
+# в строке, с планом запроса); сводка — команда slow_queries.
+SLOW_QUERY_MS = 100
+SLOW_QUERY_EXPLAIN = True
+SLOW_QUERY_LOG = os.path.join(RUNTIME_DIR, 'slow_queries.jsonl')
+
+# Профили запросов сотрудников (?_profile=cpu|memory, core.profiling):
+# хранятся последние PROFILING_KEEP, список — /staff/profiles/.
+PROFILING_DIR = os.path.join(RUNTIME_DIR, 'profiles')
+PROFILING_KEEP = 50
+
+# Строка лога на каждый запрос (core.middleware.InstrumentationMiddleware):
+# JSON с именем URL и временем базы, шаблонов и кэша. В прогоне тестов
+# не выводится.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+        'slow_queries': {
+            'class': 'logging.FileHandler',
+            'filename': SLOW_QUERY_LOG,
+            'encoding': 'utf-8',
+            'delay': True,
+        },
+    },
+    'loggers': {
+        'core.middleware': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'core.slow_queries': {
+            'handlers': ['slow_queries'],
+            'level': 'WARNING',
+            'propagate': False,
+        },
+    },
 }
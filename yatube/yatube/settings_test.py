@@ -0,0 +1,24 @@
+""" Настройки прогона тестов (manage.py test и pytest).
+
+Файлы кэша, метрик, журнала медленных запросов и профилей лежат во
+временном каталоге: тесты чистят их и пишут в них. Остальное — как в
+рабочих настройках, включая кэш страниц гостей и пул миниатюр; тесты,
+которым они мешают, выключают их через override_settings.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES, LOGGING
+
+RUNTIME_DIR = tempfile.mkdtemp(prefix='yatube-test-')
+atexit.register(shutil.rmtree, RUNTIME_DIR, True)
+
+CACHES['shared']['LOCATION'] = os.path.join(RUNTIME_DIR, 'cache.sqlite3')
+METRICS_PATH = os.path.join(RUNTIME_DIR, 'metrics.sqlite3')
+SLOW_QUERY_LOG = os.path.join(RUNTIME_DIR, 'slow_queries.jsonl')
+PROFILING_DIR = os.path.join(RUNTIME_DIR, 'profiles')
+LOGGING['handlers']['slow_queries']['filename'] = SLOW_QUERY_LOG
+LOGGING['loggers']['core.middleware']['level'] = 'WARNING'